@@ -1,12 +1,13 @@
-from azure.storage.blob import BlobServiceClient
 from fastapi import HTTPException
 import asyncio
+from function.startup_profile import lazy_import
 
 class AzBlobClient:
     def __init__(self, az_blob_connection: str, az_container_name: str):
         """
         Azure Blob Storageクラスの初期化。
         """
+        BlobServiceClient = lazy_import("azure.storage.blob").BlobServiceClient
         self.blob_service_client = BlobServiceClient.from_connection_string(az_blob_connection)
         self.container_client = self.blob_service_client.get_container_client(az_container_name)
         self.az_container_name = az_container_name
@@ -17,8 +18,8 @@ class AzBlobClient:
         """
         try:
             blob_client = self.container_client.get_blob_client(blob=file_name)
-            # ファイルをアップロード
-            blob_client.upload_blob(file_data, overwrite=True)
+            # ファイルをアップロード（同期APIなのでスレッドで実行）
+            await asyncio.to_thread(blob_client.upload_blob, file_data, overwrite=True)
             # アップロードしたBlobのURLを返す
             return blob_client.url
         except Exception as e:
@@ -29,11 +30,12 @@ class AzBlobClient:
     async def download_blob(self,blob_name: str, container_name: str, connection_string: str) -> bytes:
         try:
             # BlobServiceClientを作成して、BlobClientを取得
+            BlobServiceClient = lazy_import("azure.storage.blob").BlobServiceClient
             blob_service_client = BlobServiceClient.from_connection_string(connection_string)
             blob_client = blob_service_client.get_blob_client(container=container_name, blob=blob_name)
 
             # 非同期でBlobをダウンロード
-            download_stream =blob_client.download_blob()
+            download_stream = await asyncio.to_thread(blob_client.download_blob)
             file_data = await asyncio.to_thread(download_stream.readall)
             return bytes(file_data)
 
@@ -41,13 +43,26 @@ class AzBlobClient:
             print(f"Error downloading blob {blob_name}: {str(e)}")
             raise
             
+    async def read_blob(self, blob_name: str) -> bytes:
+        """
+        このクライアントのコンテナからBlobの内容を読み込む。
+        """
+        try:
+            blob_client = self.container_client.get_blob_client(blob=blob_name)
+            download_stream = await asyncio.to_thread(blob_client.download_blob)
+            return bytes(await asyncio.to_thread(download_stream.readall))
+        except Exception as e:
+            raise HTTPException(
+                status_code=500, detail=f"Failed to read blob: {str(e)}"
+            )
+
     async def delete_blob(self, blob_name: str):
         """
         Azure Blob Storageからファイルを削除する。
         """
         try:
             # Blobを削除
-            self.container_client.delete_blob(blob_name)
+            await asyncio.to_thread(self.container_client.delete_blob, blob_name)
         except Exception as e:
             raise HTTPException(
                 status_code=500, detail=f"Failed to delete blob: {str(e)}"
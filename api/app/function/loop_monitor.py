@@ -0,0 +1,110 @@
+import asyncio
+import logging
+import sys
+import threading
+import time
+import traceback
+from function.metrics import metrics
+
+logger = logging.getLogger("LoopMonitor")
+
+metrics.describe(
+    "event_loop_lag_seconds",
+    "histogram",
+    "Delay between a scheduled wake-up of the event loop and the actual wake-up.",
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10),
+)
+metrics.describe("event_loop_blocked_total", "counter", "Times the event loop was held longer than the threshold.")
+metrics.describe("event_loop_blocked_seconds_total", "counter", "Total duration of event loop blocks longer than the threshold.")
+
+
+class LoopLagMonitor:
+    def __init__(self, interval: float = 0.1, threshold: float = 0.25, asyncio_debug: bool = False):
+        """
+        イベントループの遅延を計測し、ループを長時間占有した処理のスタックを記録するクラスの初期化。
+
+        :param interval: ループ遅延をサンプリングする間隔（秒）
+        :param threshold: ブロッキングとみなす占有時間（秒）
+        :param asyncio_debug: asyncioのデバッグモード（slow callbackの警告）も有効にするか
+        """
+        self.interval = interval
+        self.threshold = threshold
+        self.asyncio_debug = asyncio_debug
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._loop_thread_id: int | None = None
+        self._sampler: asyncio.Task | None = None
+        self._watchdog: threading.Thread | None = None
+        self._stopped = threading.Event()
+        self._heartbeat = time.monotonic()
+        self._blocked_since: float | None = None
+
+    async def start(self):
+        """
+        サンプリング用のタスクと監視スレッドを起動する。
+        """
+        self._loop = asyncio.get_running_loop()
+        self._loop_thread_id = threading.get_ident()
+        if self.asyncio_debug:
+            self._loop.set_debug(True)
+            self._loop.slow_callback_duration = self.threshold
+        self._heartbeat = time.monotonic()
+        self._stopped.clear()
+        self._sampler = asyncio.create_task(self._sample())
+        self._watchdog = threading.Thread(target=self._watch, name="loop-monitor", daemon=True)
+        self._watchdog.start()
+        logger.info(f"Event loop monitor started (interval={self.interval}s, threshold={self.threshold}s)")
+
+    async def stop(self):
+        """
+        サンプリングと監視を停止する。
+        """
+        self._stopped.set()
+        if self._sampler is not None:
+            self._sampler.cancel()
+            try:
+                await self._sampler
+            except asyncio.CancelledError:
+                pass
+        if self._watchdog is not None:
+            await asyncio.to_thread(self._watchdog.join, self.interval * 2)
+
+    async def _sample(self):
+        """
+        一定間隔でスリープし、予定時刻からの遅れをループ遅延として記録する。
+        """
+        while True:
+            scheduled = self._loop.time() + self.interval
+            await asyncio.sleep(self.interval)
+            lag = max(self._loop.time() - scheduled, 0.0)
+            metrics.observe("event_loop_lag_seconds", lag)
+            self._heartbeat = time.monotonic()
+
+    def _watch(self):
+        """
+        別スレッドからハートビートを監視し、ループが止まっていればそのスタックを出力する。
+        """
+        poll = min(self.interval, self.threshold) / 2
+        while not self._stopped.wait(poll):
+            stalled = time.monotonic() - self._heartbeat - self.interval
+            if stalled > self.threshold:
+                if self._blocked_since is None:
+                    self._blocked_since = self._heartbeat
+                    self._report(stalled)
+            elif self._blocked_since is not None:
+                # ループが復帰したので、ブロックしていた時間を記録する
+                blocked = time.monotonic() - self._blocked_since - self.interval
+                metrics.inc("event_loop_blocked_seconds_total", max(blocked, 0.0))
+                logger.warning(f"Event loop resumed after being blocked for {blocked:.3f}s")
+                self._blocked_since = None
+
+    def _report(self, stalled: float):
+        """
+        ループスレッドの現在のスタックをログに出力する。
+        """
+        metrics.inc("event_loop_blocked_total")
+        frame = sys._current_frames().get(self._loop_thread_id)
+        stack = "".join(traceback.format_stack(frame)) if frame is not None else "<unavailable>"
+        logger.warning(
+            f"Event loop blocked for more than {stalled:.3f}s "
+            f"(threshold={self.threshold}s). Current stack:\n{stack}"
+        )
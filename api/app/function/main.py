@@ -1,23 +1,43 @@
-from fastapi import FastAPI, File, UploadFile, HTTPException, Form, Depends, Request, BackgroundTasks, WebSocket
+from fastapi import FastAPI, File, UploadFile, HTTPException, Form, Depends, Request, WebSocket
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
 import os
 import json
+import time
+import uuid
+import asyncio
+import functools
 from dotenv import load_dotenv
 import traceback
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, PlainTextResponse
 import aiohttp
 from starlette.websockets import WebSocketDisconnect
 from contextlib import asynccontextmanager
-from azure.storage.queue import QueueClient
+from typing import TYPE_CHECKING
 from function.transcribe_audio import AzTranscriptionClient
 from function.summary_text import AzOpenAIClient
 from function.blob_processor import AzBlobClient
 from function.mp4_processor import mp4_processor
 from function.word_generator import create_word, cleanup_file
 from function.sharepoint_processor import SharePointAccessClass
+from function.metrics import metrics
+from function.loop_monitor import LoopLagMonitor
+from function.scheduler import FairScheduler, ScheduledJob
+from function.transcription_batcher import TranscriptionBatcher
+from function import startup_profile
+from function.startup_profile import lazy_import
+from function.summary_text import get_encoding
+from function.mp4_processor import get_ffmpeg_path
+from function.search_index import SearchIndex
+from function.transcript_archive import archive_transcript
+from function.queue_lease import QueueMessageLease, dead_letter_message
 from urllib.parse import urlparse
 
+if TYPE_CHECKING:
+    from azure.storage.queue import QueueClient
+
+startup_profile.mark("imports")
+
 # 環境変数をロード
 load_dotenv()
 # 環境変数
@@ -32,56 +52,272 @@ CLIENT_SECRET = os.getenv("CLIENT_SECRET")
 TENANT_ID = os.getenv("TENANT_ID")
 CONNECTION_STRING = os.getenv("CONNECTION_STRING")
 QUEUE_NAME = os.getenv("QUEUE_NAME")
+# イベントループのブロッキング検出（デバッグ用）
+LOOP_MONITOR_ENABLED = os.getenv("LOOP_MONITOR_ENABLED", "false").lower() == "true"
+LOOP_MONITOR_THRESHOLD = float(os.getenv("LOOP_MONITOR_THRESHOLD", "0.25"))
+# スケジューラ設定（レーンごとの同時実行数、短時間ジョブの上限、テナントの重み）
+SCHEDULER_SHORT_CONCURRENCY = int(os.getenv("SCHEDULER_SHORT_CONCURRENCY", "3"))
+SCHEDULER_LONG_CONCURRENCY = int(os.getenv("SCHEDULER_LONG_CONCURRENCY", "1"))
+SCHEDULER_SHORT_JOB_MAX_SECONDS = float(os.getenv("SCHEDULER_SHORT_JOB_MAX_SECONDS", "1800"))
+SCHEDULER_WEIGHTS = json.loads(os.getenv("SCHEDULER_WEIGHTS", "{}"))
+# 長さが不明な場合にファイルサイズから長さを推定するためのビットレート（バイト/秒）
+SCHEDULER_BYTES_PER_SECOND = float(os.getenv("SCHEDULER_BYTES_PER_SECOND", "250000"))
+# /record 1回あたりにキューから受信する最大件数（実際にはスケジューラの空きスロット数まで）
+RECORD_PREFETCH = int(os.getenv("RECORD_PREFETCH", "16"))
+# 受信したメッセージの可視性タイムアウト（秒）。処理が終わるまでこの半分の間隔で延長する
+RECORD_VISIBILITY_TIMEOUT = int(os.getenv("RECORD_VISIBILITY_TIMEOUT", "300"))
+# この回数を超えて受信されたメッセージは処理に失敗し続けているとみなし、poisonキューに移す
+RECORD_MAX_DEQUEUE_COUNT = int(os.getenv("RECORD_MAX_DEQUEUE_COUNT", "5"))
+POISON_QUEUE_NAME = os.getenv("POISON_QUEUE_NAME") or f"{QUEUE_NAME}-poison"
+# 起動直後にバックグラウンドで重いモジュールやtiktoken・ffmpegを準備しておくか
+WARM_UP_ON_STARTUP = os.getenv("WARM_UP_ON_STARTUP", "true").lower() == "true"
+# 文字起こしジョブのバッチ化（待ち時間を0にすると1件ずつジョブを作成する）
+TRANSCRIPTION_BATCH_WINDOW_SECONDS = float(os.getenv("TRANSCRIPTION_BATCH_WINDOW_SECONDS", "2"))
+TRANSCRIPTION_BATCH_MAX_SIZE = int(os.getenv("TRANSCRIPTION_BATCH_MAX_SIZE", "20"))
+# 全文検索インデックスの保存先と、マージするセグメント数
+# 永続ボリュームをマウントしたディレクトリを指定する（未設定なら索引を作らず、/search は503を返す）。
+# 索引は処理したコンテナにしか作られないので、検索を使うのはAPIを1レプリカで動かす場合のみとする
+SEARCH_INDEX_DIR = os.getenv("SEARCH_INDEX_DIR")
+SEARCH_INDEX_MERGE_FACTOR = int(os.getenv("SEARCH_INDEX_MERGE_FACTOR", "8"))
+# 文字起こし結果の保存先（空にすると保存しない）。function.reprocess で議事録を作り直す際に使う
+TRANSCRIPT_ARCHIVE_PREFIX = os.getenv("TRANSCRIPT_ARCHIVE_PREFIX", "transcripts/")
+# 文字起こし前の無音の圧縮（有効時のみ）
+SILENCE_TRIM_ENABLED = os.getenv("SILENCE_TRIM_ENABLED", "false").lower() == "true"
+SILENCE_TRIM = {
+    "threshold_db": float(os.getenv("SILENCE_TRIM_THRESHOLD_DB", "-45")),
+    "min_silence_seconds": float(os.getenv("SILENCE_TRIM_MIN_SILENCE_SECONDS", "2")),
+    "keep_silence_seconds": float(os.getenv("SILENCE_TRIM_KEEP_SILENCE_SECONDS", "0.5")),
+} if SILENCE_TRIM_ENABLED else None
 
 # FastAPI側でのモデルを定義
 class Transcribe(BaseModel):
     project: str
     project_directory: str
 
+def parse_queue_message(msg) -> dict:
+    """
+    キューのメッセージを解析する。不正なメッセージは ValueError を送出する。
+    """
+    message_data = msg.content
+    if not message_data:
+        raise ValueError("Message data is empty")
+    # メッセージから必要なデータを抽出（例：JSON形式でproject_data、file、client_idを取得）
+    data = json.loads(message_data)
+    if not isinstance(data, dict):
+        raise ValueError("Message data is not a JSON object")
+    project = data.get('project')
+    project_directory = data.get('project_Directory')
+    # project が欠けている場合は ValidationError（ValueErrorのサブクラス）になる
+    project_data = Transcribe(project=project, project_directory=project_directory)
+    file_data = data.get('file_path')  # ファイル情報（URL）
+    if not file_data:
+        raise ValueError("Missing required field: file_path")
+    client_id = data.get('client_id')
+    # 取り込み側で発行されたジョブIDを引き継ぐ（古いメッセージには無いので採番する）
+    job_id = data.get('job_id') or uuid.uuid4().hex
+    enqueued_at = data.get('enqueued_at')
+    if enqueued_at is None and msg.inserted_on is not None:
+        enqueued_at = msg.inserted_on.timestamp()
+    if enqueued_at is not None:
+        metrics.observe("queue_lag_seconds", max(time.time() - enqueued_at, 0.0))
+    return {
+        "status":"success",
+        "project_data":project_data,
+        "client_id":client_id,
+        "file_url":file_data,
+        "job_id":job_id,
+        "priority":data.get('priority') or "normal",
+        "file_size":data.get('file_size'),
+        # 取り込み時にヘッダから取得したメディア情報（長さ・コーデックなど）
+        "duration_seconds":data.get('duration_seconds'),
+        "media":data.get('media'),
+    }
+
 # キューからメッセージを非同期的に取得
-async def process_queue_message(queue_client: QueueClient):
+async def process_queue_messages(queue_client: "QueueClient", max_messages: int = 1) -> list[dict]:
+    """
+    キューからメッセージを最大 max_messages 件受信する。
+    メッセージは削除せず、処理が終わるまで可視性タイムアウトを延長し続けるリース（"lease"）を付けて返す。
+    解析できないメッセージや失敗を繰り返しているメッセージは、そのメッセージだけpoisonキューに移す。
+    """
     try:
-        messages = queue_client.receive_messages(messages_per_page=1)  # メッセージを1件取得
-        for msg in messages:
-            message_data = msg.content
-            if not message_data:
-                raise HTTPException(status_code=400, detail="Message data is empty")
-            try:
-                # メッセージから必要なデータを抽出（例：JSON形式でproject_data、file、client_idを取得）
-                data = json.loads(message_data)  
-                project= data.get('project')
-                project_directory = data.get('project_Directory') 
-                project_data = Transcribe(project=project, project_directory=project_directory)
-                file_data = data.get('file_path')  # ファイル情報（URL）
-                client_id = data.get('client_id')
-               
-                # メッセージを削除（処理完了後）
-                queue_client.delete_message(msg)
-
-                return {
-                    "status":"success",
-                    "project_data":project_data,
-                    "client_id":client_id,
-                    "file_url":file_data
-                }     
-
-            except json.JSONDecodeError as e:
-                # JSONが不正な場合のエラーハンドリング
-                raise HTTPException(status_code=400, detail=f"Invalid JSON data: {e}")
-            except KeyError as e:
-                # 必要なキーが欠けている場合のエラーハンドリング
-                raise HTTPException(status_code=400, detail=f"Missing required field: {e}")
-
+        # キューへの通信は同期APIなのでスレッドで実行し、イベントループを止めない
+        messages = await asyncio.to_thread(
+            lambda: list(queue_client.receive_messages(
+                messages_per_page=max_messages,
+                max_messages=max_messages,
+                visibility_timeout=RECORD_VISIBILITY_TIMEOUT,
+            ))
+        )  # メッセージを最大max_messages件取得
     except Exception as e:
-        # キューの受信やその他のエラー処理
+        # キューの受信エラー
         raise HTTPException(status_code=500, detail=f"Error processing queue message: {str(e)}")
 
+    results = []
+    for msg in messages:
+        if msg.dequeue_count is not None and msg.dequeue_count > RECORD_MAX_DEQUEUE_COUNT:
+            await dead_letter_message(
+                queue_client, get_poison_queue_client(), msg, f"dequeued {msg.dequeue_count} times"
+            )
+            continue
+        try:
+            result = parse_queue_message(msg)
+        except (ValueError, TypeError) as e:
+            # JSONが不正・必要なキーが欠けている場合は、このメッセージだけ除外して続ける
+            await dead_letter_message(queue_client, get_poison_queue_client(), msg, f"invalid message: {e}")
+            continue
+        lease = QueueMessageLease(queue_client, msg, visibility_timeout=RECORD_VISIBILITY_TIMEOUT)
+        lease.start()
+        result["lease"] = lease
+        results.append(result)
+    return results
+
+async def process_queue_message(queue_client: "QueueClient"):
+    messages = await process_queue_messages(queue_client, max_messages=1)
+    return messages[0] if messages else None
+
+def estimate_audio_seconds(queue: dict) -> float | None:
+    """
+    キューメッセージの情報から音声の長さ（秒）を推定する。
+    取り込み時に解析した長さがあればそれを使い、なければファイルサイズから推定する。
+    """
+    if queue.get("duration_seconds"):
+        return float(queue["duration_seconds"])
+    file_size = queue.get("file_size")
+    if file_size:
+        return file_size / SCHEDULER_BYTES_PER_SECOND
+    return None
+
+def warm_up():
+    """
+    初回リクエストの遅延を避けるため、起動後に重いモジュールの読み込みと初期化を済ませておく。
+    """
+    try:
+        for module_name in ("openai", "azure.storage.blob", "azure.storage.queue", "docx", "msal", "requests"):
+            lazy_import(module_name)
+        get_encoding()
+        get_ffmpeg_path()
+        get_search_index()
+        startup_profile.mark("warmed_up")
+    except Exception as e:
+        print(f"Warm-up failed: {str(e)}")
+
+async def pull_jobs(app: FastAPI, clients: dict) -> list[dict]:
+    """
+    スケジューラの空きスロット数だけキューからメッセージを受信し、ジョブとして投入する。
+    待ちのジョブはキューに残るので、再起動しても失われず、他のコンテナも受信できる。
+    """
+    scheduler: FairScheduler = app.state.scheduler
+    queue_client = get_queue_client()
+    # 同時に呼ばれても空きスロット以上に受信しないよう、受信と投入は1つずつ行う
+    async with app.state.pull_lock:
+        free_slots = min(scheduler.free_slots(), RECORD_PREFETCH)
+        if free_slots <= 0:
+            return []
+        queues = await process_queue_messages(queue_client, max_messages=free_slots)
+        jobs = []
+        for queue in queues:
+            project_data_dict = queue["project_data"].model_dump()
+            client_id = queue["client_id"]
+            job_id = queue["job_id"]
+            task = functools.partial(
+                process_audio_task,
+                client_id,
+                queue["file_url"],
+                project_data_dict,
+                clients["az_blob_client"],
+                clients["az_speech_client"],
+                clients["az_openai_client"],
+                clients["sp_access"],
+                job_id,
+                estimate_audio_seconds(queue),
+            )
+            app.state.leases.add(queue["lease"])
+            lane = await scheduler.submit(ScheduledJob(
+                job_id=job_id,
+                client_id=client_id,
+                project=project_data_dict["project"],
+                run=functools.partial(run_leased_job, app, clients, queue["lease"], task),
+                priority=queue["priority"],
+                estimated_seconds=estimate_audio_seconds(queue),
+            ))
+            jobs.append({"job_id": job_id, "lane": lane})
+        return jobs
+
+async def run_leased_job(app: FastAPI, clients: dict, lease: QueueMessageLease, task):
+    """
+    ジョブを実行し、終わったらメッセージを削除して、空いたスロットの分だけ次のメッセージを受信する。
+    停止時にキャンセルされた場合はメッセージを削除せず、可視性タイムアウト後に再び受信されるようにする。
+    """
+    try:
+        await task()
+    except asyncio.CancelledError:
+        lease.abandon()
+        app.state.leases.discard(lease)
+        raise
+    except Exception:
+        # ジョブ自体の失敗は再実行しても同じ結果になるので、メッセージは削除する
+        await finish_leased_job(app, clients, lease)
+        raise
+    await finish_leased_job(app, clients, lease)
+
+async def finish_leased_job(app: FastAPI, clients: dict, lease: QueueMessageLease):
+    await lease.complete()
+    app.state.leases.discard(lease)
+    refill = asyncio.create_task(refill_jobs(app, clients))
+    # タスクがGCされないよう完了まで参照を保持する
+    app.state.pull_tasks.add(refill)
+    refill.add_done_callback(app.state.pull_tasks.discard)
+
+async def refill_jobs(app: FastAPI, clients: dict):
+    try:
+        await pull_jobs(app, clients)
+    except Exception as e:
+        print(f"Failed to pull queue messages: {str(e)}")
+
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     session = aiohttp.ClientSession()
     app.state.session = session
     app.state.connections = {}
+    app.state.transcription_batcher = None
+    if TRANSCRIPTION_BATCH_WINDOW_SECONDS > 0:
+        app.state.transcription_batcher = TranscriptionBatcher(
+            AzTranscriptionClient(session, AZ_SPEECH_KEY, AZ_SPEECH_ENDPOINT),
+            window_seconds=TRANSCRIPTION_BATCH_WINDOW_SECONDS,
+            max_batch_size=TRANSCRIPTION_BATCH_MAX_SIZE,
+            short_job_max_seconds=SCHEDULER_SHORT_JOB_MAX_SECONDS,
+        )
+    scheduler = FairScheduler(
+        lane_concurrency={"short": SCHEDULER_SHORT_CONCURRENCY, "long": SCHEDULER_LONG_CONCURRENCY},
+        short_job_max_seconds=SCHEDULER_SHORT_JOB_MAX_SECONDS,
+        weights=SCHEDULER_WEIGHTS,
+    )
+    scheduler.start()
+    app.state.scheduler = scheduler
+    app.state.pull_lock = asyncio.Lock()
+    app.state.pull_tasks = set()
+    app.state.leases = set()
+    loop_monitor = None
+    if LOOP_MONITOR_ENABLED:
+        loop_monitor = LoopLagMonitor(threshold=LOOP_MONITOR_THRESHOLD, asyncio_debug=True)
+        await loop_monitor.start()
+    # 起動は待たせず、ウォームアップはスレッドで並行して行う
+    warm_up_task = asyncio.create_task(asyncio.to_thread(warm_up)) if WARM_UP_ON_STARTUP else None
+    startup_profile.mark("app_ready")
+    print(f"startup_profile: {startup_profile.report()}")
     yield
+    if warm_up_task is not None:
+        await warm_up_task
+    if loop_monitor is not None:
+        await loop_monitor.stop()
+    for task in list(app.state.pull_tasks):
+        task.cancel()
+    # 未完了のメッセージは削除しない。延長を止めるので、可視性タイムアウト後に再び受信される
+    await scheduler.stop()
+    for lease in list(app.state.leases):
+        lease.abandon()
+    app.state.leases.clear()
     await session.close()
     
 # FastAPIアプリケーションの初期化
@@ -95,11 +331,28 @@ app.add_middleware(
     allow_headers=["*"],
 )
 # クラスの依存性を定義する関数
+@functools.cache
 def get_az_blob_client():
+    # BlobServiceClientはスレッドセーフなので、接続プールごと使い回す
     return AzBlobClient(AZ_BLOB_CONNECTION, AZ_CONTAINER_NAME)
+@functools.cache
+def get_queue_client() -> "QueueClient":
+    QueueClient = lazy_import("azure.storage.queue").QueueClient
+    return QueueClient.from_connection_string(CONNECTION_STRING, QUEUE_NAME)
+@functools.cache
+def get_poison_queue_client() -> "QueueClient":
+    QueueClient = lazy_import("azure.storage.queue").QueueClient
+    return QueueClient.from_connection_string(CONNECTION_STRING, POISON_QUEUE_NAME)
+@functools.cache
+def get_search_index() -> SearchIndex | None:
+    # セグメントの読み込みは重いので、プロセス内で1つのインデックスを共有する
+    if not SEARCH_INDEX_DIR:
+        return None
+    return SearchIndex(SEARCH_INDEX_DIR, merge_factor=SEARCH_INDEX_MERGE_FACTOR)
 def get_az_speech_client(request: Request):
     session = request.app.state.session
-    return AzTranscriptionClient(session, AZ_SPEECH_KEY, AZ_SPEECH_ENDPOINT)
+    batcher = request.app.state.transcription_batcher
+    return AzTranscriptionClient(session, AZ_SPEECH_KEY, AZ_SPEECH_ENDPOINT, batcher=batcher)
 def get_az_openai_client():
     return AzOpenAIClient(AZ_OPENAI_KEY, AZ_OPENAI_ENDPOINT)
 def get_sp_access():
@@ -159,24 +412,82 @@ async def process_audio_task(
     az_speech_client: AzTranscriptionClient,
     az_openai_client: AzOpenAIClient,
     sp_access: SharePointAccessClass,
+    job_id: str = "",
+    duration_seconds: float | None = None,
 ):
     """音声処理をバックグラウンドで行い、WebSocketで通知"""
+    metrics.add_gauge("jobs_in_progress", 1)
+    status = "success"
     try:
         # MP4ファイル処理
-        file_name, file_content = await download_blob_from_url(file_url,az_blob_client)
-        wav_sound_data = await mp4_processor(file_name, file_content)
+        with metrics.timer("stage_duration_seconds", stage="download"):
+            file_name, file_content = await download_blob_from_url(file_url,az_blob_client)
+        with metrics.timer("stage_duration_seconds", stage="convert"):
+            wav_sound_data = await mp4_processor(file_name, file_content, SILENCE_TRIM)
         file_wavname = wav_sound_data["file_wavname"]
         wav_data = wav_sound_data["wav_data"]
         file_mp4name = wav_sound_data["file_mp4name"]
-        await az_blob_client.delete_blob(file_mp4name)
-        blob_url  = await az_blob_client.upload_blob(file_wavname, wav_data)
+        # 無音を詰めた場合の時刻対応表（文字起こし結果の時刻を元の録音に戻すために使う）
+        offset_map = wav_sound_data["offset_map"]
+        original_duration_seconds = wav_sound_data["original_duration_seconds"] or duration_seconds
+        transcribed_seconds = original_duration_seconds
+        if offset_map is not None:
+            transcribed_seconds = sum(segment[2] for segment in offset_map)
+            print(f"silence_trimmed: {len(offset_map)} segments, {transcribed_seconds:.1f}s kept job_id={job_id}")
+        with metrics.timer("stage_duration_seconds", stage="upload_wav"):
+            await az_blob_client.delete_blob(file_mp4name)
+            blob_url  = await az_blob_client.upload_blob(file_wavname, wav_data)
         # 文字起こし
-        transcribed_text = await az_speech_client.transcribe_audio(blob_url)
+        with metrics.timer("stage_duration_seconds", stage="transcribe"):
+            transcribed_text = await az_speech_client.transcribe_audio(blob_url, transcribed_seconds)
+        document_id = job_id or os.path.splitext(file_name)[0]
+        document_fields = {
+            "title": file_name,
+            "project": project_data_dict["project"],
+            "project_directory": project_data_dict["project_directory"],
+            "client_id": client_id,
+            "created_at": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        }
+        # 後から要約だけを作り直せるよう、文字起こし結果を保存（失敗しても処理は続ける）
+        if TRANSCRIPT_ARCHIVE_PREFIX:
+            try:
+                with metrics.timer("stage_duration_seconds", stage="archive"):
+                    await archive_transcript(
+                        az_blob_client,
+                        TRANSCRIPT_ARCHIVE_PREFIX,
+                        document_id,
+                        {
+                            **document_fields,
+                            # 元の録音の長さと、実際に文字起こしした（無音を詰めた後の）長さ
+                            "duration_seconds": original_duration_seconds,
+                            "transcribed_seconds": transcribed_seconds,
+                            "offset_map": offset_map,
+                        },
+                        transcribed_text,
+                    )
+            except Exception as e:
+                print(f"Failed to archive transcript job_id={job_id}: {str(e)}")
         # 要約処理
-        summarized_text = await az_openai_client.summarize_text(transcribed_text)
+        with metrics.timer("stage_duration_seconds", stage="summarize"):
+            summarized_text = await az_openai_client.summarize_text(transcribed_text)
+        # 全文検索インデックスに登録（失敗しても議事録の作成は続ける）
+        search_index = get_search_index()
+        if search_index is not None:
+            try:
+                with metrics.timer("stage_duration_seconds", stage="index"):
+                    await asyncio.to_thread(
+                        search_index.add_document,
+                        document_id,
+                        document_fields,
+                        transcribed_text,
+                        summarized_text,
+                    )
+            except Exception as e:
+                print(f"Failed to index transcript job_id={job_id}: {str(e)}")
         # SharePointにWordファイルをアップロード
-        word_file_path = await create_word(summarized_text)
-        print(f"finish_create_word:{word_file_path}")
+        with metrics.timer("stage_duration_seconds", stage="create_word"):
+            word_file_path = await create_word(summarized_text)
+        print(f"finish_create_word:{word_file_path} job_id={job_id}")
         #sp_access.upload_file(
         #    project_data_dict["project"],
         #    project_data_dict["project_directory"],
@@ -187,14 +498,19 @@ async def process_audio_task(
         #    await app.state.connections[client_id].send_text(summarized_text)
         # Blobストレージから削除
         if file_wavname:
-            await az_blob_client.delete_blob(file_wavname)
-            print("finish_delete_blob")
+            with metrics.timer("stage_duration_seconds", stage="cleanup"):
+                await az_blob_client.delete_blob(file_wavname)
+            print(f"finish_delete_blob job_id={job_id}")
     except Exception as e:
-        print(f"Error processing file for client {client_id}: {str(e)}")
+        status = "error"
+        print(f"Error processing file for client {client_id} job_id={job_id}: {str(e)}")
+    finally:
+        metrics.add_gauge("jobs_in_progress", -1)
+        metrics.inc("jobs_total", status=status)
 
 @app.post("/record")
 async def main(
-    background_tasks: BackgroundTasks,
+    request: Request,
     az_blob_client: AzBlobClient = Depends(get_az_blob_client),
     az_speech_client: AzTranscriptionClient = Depends(get_az_speech_client),
     az_openai_client: AzOpenAIClient = Depends(get_az_openai_client),
@@ -202,15 +518,9 @@ async def main(
     ) -> dict:
     """
     音声ファイルを文字起こしし、要約を返すエンドポイント。
+    スケジューラの空きスロット数だけキューから受信し、レーンとテナントの配分に従って処理する。
+    メッセージは処理が終わるまでキューに残し、終わったジョブの分だけ次のメッセージを受信する。
     """
-    queue_client = QueueClient.from_connection_string(CONNECTION_STRING,QUEUE_NAME) 
-    queue = await process_queue_message(queue_client)
-    project_data = queue["project_data"]
-    client_id = queue["client_id"]
-    file_url = queue["file_url"]
-
-
-
     #if client_id not in app.state.connections:
     #    return JSONResponse(
     #        status_code=400,
@@ -219,19 +529,19 @@ async def main(
     #        },
     #    )
 
-    project_data_dict = project_data.model_dump()
+    clients = {
+        "az_blob_client": az_blob_client,
+        "az_speech_client": az_speech_client,
+        "az_openai_client": az_openai_client,
+        "sp_access": sp_access,
+    }
     try:
-        background_tasks.add_task(
-            process_audio_task,
-            client_id,
-            file_url,
-            project_data_dict,
-            az_blob_client,
-            az_speech_client,
-            az_openai_client,
-            sp_access,
-        )
-        return {"message": "処理を開始しました"}
+        jobs = await pull_jobs(request.app, clients)
+        if not jobs:
+            if request.app.state.scheduler.free_slots() <= 0:
+                return {"message": "処理中のジョブが上限に達しています。終わり次第キューから取り出します", "jobs": []}
+            return {"message": "キューにメッセージがありません", "jobs": []}
+        return {"message": "処理を開始しました", "jobs": jobs}
 
     except Exception as e:
         return JSONResponse(
@@ -249,7 +559,7 @@ async def get_sites(sp_access: SharePointAccessClass = Depends(get_sp_access)):
     サイト一覧を取得するエンドポイント
     """
     try:
-        return sp_access.get_sites()
+        return await asyncio.to_thread(sp_access.get_sites)
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"サイト取得中にエラーが発生しました: {str(e)}")
 
@@ -259,6 +569,41 @@ async def get_directories(site_id: str, sp_access: SharePointAccessClass = Depen
     指定されたサイトIDのディレクトリ一覧を取得するエンドポイント
     """
     try:
-        return sp_access.get_folders(site_id)
+        return await asyncio.to_thread(sp_access.get_folders, site_id)
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"ディレクトリ取得中にエラーが発生しました: {str(e)}")
+
+@app.get("/search")
+async def search(
+    q: str,
+    limit: int = 20,
+    project: str | None = None,
+    search_index: SearchIndex | None = Depends(get_search_index),
+):
+    """
+    議事録と文字起こしを全文検索するエンドポイント
+    """
+    if search_index is None:
+        raise HTTPException(status_code=503, detail="全文検索は有効になっていません（SEARCH_INDEX_DIR が未設定です）")
+    if not q.strip():
+        raise HTTPException(status_code=400, detail="検索語を指定してください")
+    limit = max(1, min(limit, 100))
+    try:
+        results = await asyncio.to_thread(search_index.search, q, limit, project)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"検索中にエラーが発生しました: {str(e)}")
+    return {"query": q, "count": len(results), "results": results}
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def get_metrics():
+    """
+    Prometheus形式でメトリクスを返すエンドポイント
+    """
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+@app.get("/debug/startup")
+async def get_startup_profile():
+    """
+    起動時間のプロファイル（各フェーズの完了時刻と遅延読み込みしたモジュールの読み込み時間）を返すエンドポイント
+    """
+    return startup_profile.report()
@@ -0,0 +1,158 @@
+import time
+import threading
+from contextlib import contextmanager
+
+# ヒストグラムのバケット（秒）。数十ミリ秒のAPI呼び出しから数時間の文字起こしまでをカバーする
+DEFAULT_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1800, 3600)
+
+
+class MetricsRegistry:
+    def __init__(self, prefix: str = "vr"):
+        """
+        Prometheusテキスト形式で出力できるメトリクスを保持するクラスの初期化。
+        値はプロセス内にだけ保持するので、APIは1コンテナ1ワーカーで動かす前提とする。
+        """
+        self.prefix = prefix
+        self._lock = threading.Lock()
+        self._help: dict[str, tuple[str, str]] = {}
+        self._counters: dict[tuple, float] = {}
+        self._gauges: dict[tuple, float] = {}
+        self._histograms: dict[tuple, list] = {}
+        self._buckets: dict[str, tuple] = {}
+
+    def describe(self, name: str, metric_type: str, help_text: str, buckets: tuple = DEFAULT_BUCKETS):
+        """
+        メトリクスの種類と説明を登録する。
+        """
+        full_name = f"{self.prefix}_{name}"
+        self._help[full_name] = (metric_type, help_text)
+        if metric_type == "histogram":
+            self._buckets[full_name] = tuple(sorted(buckets))
+
+    @staticmethod
+    def _key(name: str, labels: dict) -> tuple:
+        return (name, tuple(sorted((k, str(v)) for k, v in labels.items())))
+
+    def inc(self, name: str, value: float = 1.0, **labels):
+        """
+        カウンタを加算する。
+        """
+        key = self._key(f"{self.prefix}_{name}", labels)
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0.0) + value
+
+    def set_gauge(self, name: str, value: float, **labels):
+        """
+        ゲージに値を設定する。
+        """
+        key = self._key(f"{self.prefix}_{name}", labels)
+        with self._lock:
+            self._gauges[key] = value
+
+    def add_gauge(self, name: str, value: float, **labels):
+        """
+        ゲージに値を加算する（処理中ジョブ数などの増減に使用）。
+        """
+        key = self._key(f"{self.prefix}_{name}", labels)
+        with self._lock:
+            self._gauges[key] = self._gauges.get(key, 0.0) + value
+
+    def counter_value(self, name: str, **labels) -> float:
+        """
+        カウンタの現在値を返す（プロセス内で429の発生などを検知するために使用）。
+        """
+        key = self._key(f"{self.prefix}_{name}", labels)
+        with self._lock:
+            return self._counters.get(key, 0.0)
+
+    def observe(self, name: str, value: float, **labels):
+        """
+        ヒストグラムに観測値を記録する。
+        """
+        full_name = f"{self.prefix}_{name}"
+        key = self._key(full_name, labels)
+        buckets = self._buckets.get(full_name, DEFAULT_BUCKETS)
+        with self._lock:
+            state = self._histograms.get(key)
+            if state is None:
+                # [バケットごとの件数, 合計, 件数]
+                state = [[0] * len(buckets), 0.0, 0]
+                self._histograms[key] = state
+            for i, bound in enumerate(buckets):
+                if value <= bound:
+                    state[0][i] += 1
+            state[1] += value
+            state[2] += 1
+
+    @contextmanager
+    def timer(self, name: str, **labels):
+        """
+        with文のブロックの所要時間をヒストグラムに記録する。
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    @staticmethod
+    def _escape(value: str) -> str:
+        return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+    def _format_labels(self, labels: tuple, extra: tuple = ()) -> str:
+        pairs = list(labels) + list(extra)
+        if not pairs:
+            return ""
+        return "{" + ",".join(f'{k}="{self._escape(v)}"' for k, v in pairs) + "}"
+
+    def render(self) -> str:
+        """
+        Prometheusのテキスト形式（version 0.0.4）でメトリクスを出力する。
+        """
+        lines: list[str] = []
+        emitted: set[str] = set()
+
+        def header(name: str, default_type: str):
+            if name in emitted:
+                return
+            emitted.add(name)
+            metric_type, help_text = self._help.get(name, (default_type, ""))
+            if help_text:
+                lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {metric_type}")
+
+        with self._lock:
+            counters = sorted(self._counters.items())
+            gauges = sorted(self._gauges.items())
+            histograms = sorted(
+                (key, (list(state[0]), state[1], state[2])) for key, state in self._histograms.items()
+            )
+
+        for (name, labels), value in counters:
+            header(name, "counter")
+            lines.append(f"{name}{self._format_labels(labels)} {value}")
+        for (name, labels), value in gauges:
+            header(name, "gauge")
+            lines.append(f"{name}{self._format_labels(labels)} {value}")
+        for (name, labels), (counts, total, count) in histograms:
+            header(name, "histogram")
+            buckets = self._buckets.get(name, DEFAULT_BUCKETS)
+            for bound, bucket_count in zip(buckets, counts):
+                lines.append(f"{name}_bucket{self._format_labels(labels, (('le', str(bound)),))} {bucket_count}")
+            lines.append(f"{name}_bucket{self._format_labels(labels, (('le', '+Inf'),))} {count}")
+            lines.append(f"{name}_sum{self._format_labels(labels)} {total}")
+            lines.append(f"{name}_count{self._format_labels(labels)} {count}")
+        return "\n".join(lines) + "\n"
+
+
+# アプリ全体で共有するレジストリ
+metrics = MetricsRegistry()
+metrics.describe("stage_duration_seconds", "histogram", "Duration of each pipeline stage.")
+metrics.describe("queue_lag_seconds", "histogram", "Time between enqueue and dequeue of a job message.")
+metrics.describe("ffmpeg_duration_seconds", "histogram", "Wall time spent in ffmpeg conversion.")
+metrics.describe("speech_job_wait_seconds", "histogram", "Time from Speech job creation until it finished.")
+metrics.describe("openai_request_duration_seconds", "histogram", "Latency of Azure OpenAI chat completion requests.")
+metrics.describe("openai_tokens_total", "counter", "Azure OpenAI tokens consumed, by kind.")
+metrics.describe("http_429_total", "counter", "HTTP 429 responses received from upstream services.")
+metrics.describe("jobs_total", "counter", "Pipeline jobs finished, by status.")
+metrics.describe("jobs_in_progress", "gauge", "Pipeline jobs currently being processed.")
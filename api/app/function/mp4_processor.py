@@ -1,25 +1,41 @@
+import asyncio
+import functools
 import os
 import tempfile
 import subprocess
-import imageio_ffmpeg as ffmpeg
 from fastapi import HTTPException
+from function.metrics import metrics
+from function.startup_profile import lazy_import
+
+metrics.describe("silence_removed_seconds_total", "counter", "Seconds of silence removed before transcription.")
+
+@functools.cache
+def get_ffmpeg_path() -> str:
+    """
+    ffmpegの実行ファイルのパスを解決する（プロセス内で1回だけ）。
+    """
+    return lazy_import("imageio_ffmpeg").get_ffmpeg_exe()
 
 async def save_disk_async(file_data: bytes, destination: str):
     """
     バイナリデータをディスクに非同期で保存する関数。
     """
-    try:
+    def _write():
         with open(destination, "wb") as out_file:
             out_file.write(file_data)  # 直接bytesを書き込む
+
+    try:
+        await asyncio.to_thread(_write)
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to save file: {str(e)}")
 
 def convert_wav(input_path: str, output_path: str):
     """
     MP4ファイルをWAVフォーマットに同期的に変換する関数。
+    イベントループから呼ぶ場合は asyncio.to_thread 経由で実行すること。
     """
     try:
-        ffmpeg_path = ffmpeg.get_ffmpeg_exe()
+        ffmpeg_path = get_ffmpeg_path()
         command = [
             ffmpeg_path,
             "-i",
@@ -32,20 +48,33 @@ def convert_wav(input_path: str, output_path: str):
             "s16",  # サンプルフォーマット（16-bit PCM）
             output_path,
         ]
-        subprocess.run(command, check=True)
+        with metrics.timer("ffmpeg_duration_seconds"):
+            subprocess.run(command, check=True)
     except subprocess.CalledProcessError as e:
         raise HTTPException(status_code=500, detail=f"FFmpeg failed: {e.stderr}")
 
-async def mp4_processor(file_name: str, file_data: bytes) -> dict:
+def _trim_silence(input_path: str, output_path: str, options: dict):
+    # numpyの読み込みでイベントループを止めないよう、importもスレッド側で行う
+    from function.silence_trimmer import trim_silence
+    return trim_silence(input_path, output_path, **options)
+
+def _read_file(path: str) -> bytes:
+    with open(path, "rb") as f:
+        return f.read()
+
+async def mp4_processor(file_name: str, file_data: bytes, silence_trim: dict | None = None) -> dict:
     """
     MP4ファイルを処理し、WAVファイルに変換する関数。
+    silence_trim を指定すると（trim_silence のキーワード引数）、変換後のWAVから長い無音を詰め、
+    元の録音の時刻に戻すためのオフセットマップを "offset_map" として返す。
+    "original_duration_seconds" は無音を詰める前の長さ（WAVをそのまま使う場合はNone）。
     """
     try:
         sanitized_filename = os.path.basename(file_name)
         file_extension = os.path.splitext(sanitized_filename)[1].lower()
         # WAVファイルならそのまま返す
         if file_extension == ".wav":
-            return {"file_wavname": sanitized_filename, "file_data": file_data,"file_mp4name": sanitized_filename}
+            return {"file_wavname": sanitized_filename, "wav_data": file_data,"file_mp4name": sanitized_filename, "offset_map": None, "original_duration_seconds": None}
         # 一時ディレクトリを利用
         with tempfile.TemporaryDirectory() as tmpdir:
             input_path = os.path.join(tmpdir, sanitized_filename)
@@ -54,11 +83,22 @@ async def mp4_processor(file_name: str, file_data: bytes) -> dict:
             output_path = os.path.join(tmpdir, output_filename)
             # bytes` データをディスクに保存
             await save_disk_async(file_data, input_path)
-            # MP4をWAVに変換（同期処理）
-            convert_wav(input_path, output_path)
+            # MP4をWAVに変換（同期処理をスレッドで実行）
+            await asyncio.to_thread(convert_wav, input_path, output_path)
+            # 16kHz・16-bit・モノラルに変換しているので、サイズから元の長さが分かる
+            original_seconds = os.path.getsize(output_path) / (16000 * 2)
+            # 長い無音を詰める（オプション）
+            offset_map = None
+            if silence_trim is not None:
+                trimmed_path = os.path.join(tmpdir, "trimmed_" + output_filename)
+                with metrics.timer("stage_duration_seconds", stage="silence_trim"):
+                    offset_map = await asyncio.to_thread(_trim_silence, output_path, trimmed_path, silence_trim)
+                if offset_map is not None:
+                    kept_seconds = sum(segment[2] for segment in offset_map)
+                    metrics.inc("silence_removed_seconds_total", max(original_seconds - kept_seconds, 0.0))
+                    output_path = trimmed_path
             # WAVファイルを読み取る
-            with open(output_path, "rb") as f:
-                wav_data = f.read()
-            return {"file_wavname": output_filename, "wav_data": wav_data,"file_mp4name": output_filename_mp4}
+            wav_data = await asyncio.to_thread(_read_file, output_path)
+            return {"file_wavname": output_filename, "wav_data": wav_data,"file_mp4name": output_filename_mp4, "offset_map": offset_map, "original_duration_seconds": original_seconds}
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to process file: {str(e)}")
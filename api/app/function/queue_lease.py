@@ -0,0 +1,92 @@
+import asyncio
+from typing import TYPE_CHECKING
+from function.metrics import metrics
+
+if TYPE_CHECKING:
+    from azure.storage.queue import QueueClient, QueueMessage
+
+metrics.describe("queue_messages_dead_lettered_total", "counter", "Queue messages moved to the poison queue.")
+
+
+class QueueMessageLease:
+    def __init__(self, queue_client: "QueueClient", message: "QueueMessage", visibility_timeout: int = 300):
+        """
+        受信したメッセージを処理が終わるまでキューに残しておくためのリースの初期化。
+        可視性タイムアウトを定期的に延長し、処理が終わったら削除する。
+        プロセスが落ちた場合は延長が止まり、タイムアウト後にメッセージが再び受信できるようになる。
+        """
+        self.queue_client = queue_client
+        self.message_id = message.id
+        self.pop_receipt = message.pop_receipt
+        self.visibility_timeout = visibility_timeout
+        self._lock = asyncio.Lock()
+        self._renewer: asyncio.Task | None = None
+
+    def start(self):
+        self._renewer = asyncio.create_task(self._renew())
+
+    async def _renew(self):
+        while True:
+            await asyncio.sleep(self.visibility_timeout / 2)
+            # 延長と削除が同時に走ると古い pop_receipt で削除してしまうのでロックする
+            async with self._lock:
+                try:
+                    updated = await asyncio.to_thread(
+                        self.queue_client.update_message,
+                        self.message_id,
+                        pop_receipt=self.pop_receipt,
+                        visibility_timeout=self.visibility_timeout,
+                    )
+                    self.pop_receipt = updated.pop_receipt
+                except Exception as e:
+                    print(f"Failed to extend visibility of message {self.message_id}: {str(e)}")
+
+    def _stop_renewing(self):
+        if self._renewer is not None:
+            self._renewer.cancel()
+            self._renewer = None
+
+    def abandon(self):
+        """
+        延長だけを止め、メッセージは削除しない。可視性タイムアウト後に再び受信できるようになる。
+        処理が中断された（停止時にキャンセルされた）ジョブに使う。
+        """
+        self._stop_renewing()
+
+    async def complete(self):
+        """
+        処理が終わったメッセージをキューから削除する。
+        """
+        async with self._lock:
+            self._stop_renewing()
+            try:
+                await asyncio.to_thread(self.queue_client.delete_message, self.message_id, pop_receipt=self.pop_receipt)
+            except Exception as e:
+                print(f"Failed to delete message {self.message_id}: {str(e)}")
+
+
+async def dead_letter_message(
+    queue_client: "QueueClient",
+    poison_queue_client: "QueueClient",
+    message: "QueueMessage",
+    reason: str,
+):
+    """
+    処理できないメッセージをpoisonキューに移し、元のキューから削除する。
+    移せなかった場合はキューに残し、次に受信したときに再度移す。
+    """
+    def _move():
+        try:
+            poison_queue_client.create_queue()
+        except Exception:
+            # 既に存在する場合
+            pass
+        poison_queue_client.send_message(message.content)
+        queue_client.delete_message(message)
+
+    try:
+        await asyncio.to_thread(_move)
+        metrics.inc("queue_messages_dead_lettered_total")
+        print(f"Moved message {message.id} to poison queue: {reason}")
+    except Exception as e:
+        print(f"Failed to move message {message.id} to poison queue ({reason}): {str(e)}")
@@ -0,0 +1,414 @@
+"""
+保存済みの文字起こし結果から議事録を作り直すバッチ処理。
+
+要約のプロンプトやモデルを変えたときに、録音を再アップロードせずに過去の会議の議事録を再生成する。
+api/app で次のように実行する（途中で止めても、同じチェックポイントを指定すれば続きから再開する）。
+
+    python -m function.reprocess --checkpoint reprocess.jsonl --concurrency 2 --tokens-per-minute 30000
+
+再生成した議事録は全文検索インデックスにも登録する。--index-dir（既定は SEARCH_INDEX_DIR）には
+APIが使っている永続ボリューム上のディレクトリを指定する必要があるので、APIのコンテナ内
+（docker compose exec api など）で実行する。インデックスを更新しない場合は --no-index を指定する。
+"""
+import argparse
+import asyncio
+import json
+import math
+import os
+import time
+from pathlib import Path
+import aiohttp
+from dotenv import load_dotenv
+from function.blob_processor import AzBlobClient
+from function.metrics import metrics
+from function.search_index import SearchIndex
+from function.summary_text import AzOpenAIClient, get_encoding
+from function.transcript_archive import parse_transcript_record
+from function.word_generator import create_word, cleanup_file
+
+# summarize_text の1チャンクあたり、プロンプトの定型文と応答の上限として見込むトークン数
+PROMPT_OVERHEAD_TOKENS = 500
+COMPLETION_TOKENS = 1000
+MAX_TOKENS_PER_CHUNK = 3000
+
+
+def estimate_tokens(transcript: str) -> int:
+    """
+    1件の要約で消費するトークン数を見積もる。
+    """
+    transcript_tokens = len(get_encoding().encode(transcript))
+    chunks = max(math.ceil(transcript_tokens / MAX_TOKENS_PER_CHUNK), 1)
+    return transcript_tokens + chunks * (PROMPT_OVERHEAD_TOKENS + COMPLETION_TOKENS)
+
+
+class BudgetExhausted(Exception):
+    """
+    トークンの総予算を使い切った場合の例外。
+    """
+
+
+class TokenBucket:
+    def __init__(self, tokens_per_minute: float, min_ratio: float = 0.1):
+        """
+        1分あたりのトークン消費量を制限するトークンバケットの初期化。
+        429が返った場合は補充速度を半分にし、成功が続けば設定値まで少しずつ戻す。
+
+        :param tokens_per_minute: 1分あたりの上限（0以下なら制限しない）
+        :param min_ratio: 429で下げる補充速度の下限（設定値に対する比率）
+        """
+        self.capacity = tokens_per_minute
+        self.max_rate = tokens_per_minute / 60
+        self.min_rate = self.max_rate * min_ratio
+        self.rate = self.max_rate
+        self.tokens = float(tokens_per_minute)
+        self._updated_at = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self._updated_at) * self.rate)
+        self._updated_at = now
+
+    async def acquire(self, tokens: int):
+        """
+        指定したトークン数が補充されるまで待つ（先に待ち始めたものから順に取得する）。
+        """
+        if self.capacity <= 0:
+            return
+        # 1件で上限を超える場合も、満杯になれば処理できるようにする
+        tokens = min(tokens, self.capacity)
+        async with self._lock:
+            while True:
+                self._refill()
+                if self.tokens >= tokens:
+                    self.tokens -= tokens
+                    return
+                await asyncio.sleep((tokens - self.tokens) / self.rate)
+
+    def slow_down(self):
+        if self.capacity <= 0:
+            return
+        self._refill()
+        self.rate = max(self.rate / 2, self.min_rate)
+        self.tokens = 0.0
+
+    def speed_up(self):
+        if self.capacity <= 0:
+            return
+        self._refill()
+        self.rate = min(self.rate * 1.1, self.max_rate)
+
+    @property
+    def tokens_per_minute(self) -> float:
+        return self.rate * 60
+
+
+class Checkpoint:
+    def __init__(self, path: str):
+        """
+        処理済みのBlobを1行1件のJSONで記録するチェックポイントの初期化。
+        """
+        self.path = Path(path)
+        self.status: dict[str, str] = {}
+        needs_newline = False
+        if self.path.exists():
+            text = self.path.read_text(encoding="utf-8")
+            for line in text.splitlines():
+                try:
+                    entry = json.loads(line)
+                    self.status[entry["blob"]] = entry["status"]
+                except (ValueError, KeyError, TypeError):
+                    # 書き込み途中で止まった行は無視する
+                    continue
+            needs_newline = bool(text) and not text.endswith("\n")
+        self._file = open(self.path, "a", encoding="utf-8")
+        if needs_newline:
+            self._file.write("\n")
+
+    def should_skip(self, blob_name: str, retry_errors: bool = False) -> bool:
+        status = self.status.get(blob_name)
+        return status == "done" or (status == "error" and not retry_errors)
+
+    def record(self, blob_name: str, status: str, **fields):
+        entry = {"blob": blob_name, "status": status, "finished_at": time.time(), **fields}
+        self._file.write(json.dumps(entry, ensure_ascii=False) + "\n")
+        self._file.flush()
+        self.status[blob_name] = status
+
+    def close(self):
+        self._file.close()
+
+
+class LiveJobGuard:
+    def __init__(self, session: aiohttp.ClientSession, metrics_url: str, max_live_jobs: int = 0, poll_interval: float = 15.0):
+        """
+        APIの /metrics を見て、処理中のジョブが多い間はバッチ処理を止めるクラスの初期化。
+        APIは1コンテナ1ワーカーで動かすので、コンテナごとの /metrics のURLを指定する。
+        """
+        self.session = session
+        self.metrics_url = metrics_url
+        self.max_live_jobs = max_live_jobs
+        self.poll_interval = poll_interval
+        self.paused_seconds = 0.0
+        self._checked_at = 0.0
+        self._live_jobs: float | None = None
+
+    async def _fetch_live_jobs(self) -> float | None:
+        now = time.monotonic()
+        if now - self._checked_at < self.poll_interval:
+            return self._live_jobs
+        self._checked_at = now
+        try:
+            async with self.session.get(self.metrics_url, timeout=aiohttp.ClientTimeout(total=10)) as response:
+                text = await response.text()
+            self._live_jobs = sum(
+                float(line.rsplit(" ", 1)[1])
+                for line in text.splitlines()
+                if line.startswith("vr_jobs_in_progress")
+            )
+        except Exception as e:
+            # APIに接続できない場合は止めずに進める
+            print(f"Failed to fetch live job count: {str(e)}")
+            self._live_jobs = None
+        return self._live_jobs
+
+    async def wait_until_idle(self):
+        while True:
+            live_jobs = await self._fetch_live_jobs()
+            if live_jobs is None or live_jobs <= self.max_live_jobs:
+                return
+            await asyncio.sleep(self.poll_interval)
+            self.paused_seconds += self.poll_interval
+
+
+class Reprocessor:
+    def __init__(
+        self,
+        az_blob_client: AzBlobClient,
+        az_openai_client: AzOpenAIClient,
+        checkpoint: Checkpoint,
+        bucket: TokenBucket,
+        search_index: SearchIndex | None = None,
+        guard: LiveJobGuard | None = None,
+        concurrency: int = 2,
+        max_total_tokens: int = 0,
+        output_prefix: str = "minutes/",
+        retry_errors: bool = False,
+        dry_run: bool = False,
+        max_attempts: int = 3,
+    ):
+        """
+        保存済みの文字起こし結果を順に読み込み、要約とWordファイルの作成をやり直すクラスの初期化。
+        """
+        self.az_blob_client = az_blob_client
+        self.az_openai_client = az_openai_client
+        self.checkpoint = checkpoint
+        self.bucket = bucket
+        self.search_index = search_index
+        self.guard = guard
+        self.concurrency = concurrency
+        self.max_total_tokens = max_total_tokens
+        self.output_prefix = output_prefix
+        self.retry_errors = retry_errors
+        self.dry_run = dry_run
+        self.max_attempts = max_attempts
+        self.stats = {"listed": 0, "skipped": 0, "done": 0, "failed": 0, "tokens": 0}
+        self.budget_exhausted = False
+        self.started_at = time.monotonic()
+
+    async def run(self, prefix: str, limit: int = 0, report_interval: float = 60.0) -> dict:
+        """
+        prefix 以下のBlobを一覧しながら処理する。一覧は全件を待たず、ページ単位で流し込む。
+        """
+        self.started_at = time.monotonic()
+        # キューを小さくしておき、一覧の取得が処理より先に進みすぎないようにする
+        queue: asyncio.Queue = asyncio.Queue(maxsize=self.concurrency * 2)
+        workers = [asyncio.create_task(self._worker(queue)) for _ in range(self.concurrency)]
+        reporter = asyncio.create_task(self._report_loop(report_interval))
+        try:
+            await self._produce(queue, prefix, limit)
+            for _ in workers:
+                await queue.put(None)
+            await asyncio.gather(*workers)
+        finally:
+            reporter.cancel()
+            for worker in workers:
+                worker.cancel()
+            print(self.report())
+        return self.stats
+
+    async def _produce(self, queue: asyncio.Queue, prefix: str, limit: int):
+        pages = self.az_blob_client.container_client.list_blobs(name_starts_with=prefix).by_page()
+        queued = 0
+        while not self.budget_exhausted:
+            # 一覧の取得は同期APIなのでスレッドで実行する
+            page = await asyncio.to_thread(next, pages, None)
+            if page is None:
+                return
+            for blob in await asyncio.to_thread(list, page):
+                self.stats["listed"] += 1
+                if not blob.name.endswith(".json") or self.checkpoint.should_skip(blob.name, self.retry_errors):
+                    self.stats["skipped"] += 1
+                    continue
+                if self.budget_exhausted or (limit and queued >= limit):
+                    return
+                await queue.put(blob.name)
+                queued += 1
+
+    async def _worker(self, queue: asyncio.Queue):
+        while True:
+            blob_name = await queue.get()
+            if blob_name is None:
+                return
+            # 予算を使い切った後は、残りをチェックポイントに記録せず次回に回す
+            if not self.budget_exhausted:
+                await self._process_with_retry(blob_name)
+
+    async def _process_with_retry(self, blob_name: str):
+        for attempt in range(1, self.max_attempts + 1):
+            if self.guard is not None:
+                await self.guard.wait_until_idle()
+            throttled_before = metrics.counter_value("http_429_total", service="openai")
+            try:
+                await self._process(blob_name)
+                self.bucket.speed_up()
+                return
+            except BudgetExhausted:
+                return
+            except Exception as e:
+                error = getattr(e, "detail", None) or str(e)
+                # 429が返った場合は、稼働中のジョブに枠を譲るため消費速度を下げる
+                throttled = metrics.counter_value("http_429_total", service="openai") > throttled_before
+                if throttled:
+                    self.bucket.slow_down()
+                if attempt == self.max_attempts:
+                    self.stats["failed"] += 1
+                    self.checkpoint.record(blob_name, "error", error=str(error)[:500])
+                    print(f"Failed to reprocess {blob_name}: {error}")
+                    return
+                await asyncio.sleep(min(2 ** attempt * (15 if throttled else 5), 300))
+
+    async def _process(self, blob_name: str):
+        record = parse_transcript_record(await self.az_blob_client.read_blob(blob_name))
+        transcript = record["transcript"]
+        job_id = record.get("job_id") or Path(blob_name).stem
+        estimated = await asyncio.to_thread(estimate_tokens, transcript)
+        if self.max_total_tokens and self.stats["tokens"] + estimated > self.max_total_tokens:
+            if not self.budget_exhausted:
+                print(f"Token budget exhausted ({self.stats['tokens']}/{self.max_total_tokens})")
+            self.budget_exhausted = True
+            raise BudgetExhausted()
+        # 再試行した分も含めて予算から差し引く
+        self.stats["tokens"] += estimated
+        if self.dry_run:
+            self.stats["done"] += 1
+            return
+
+        await self.bucket.acquire(estimated)
+        summarized_text = await self.az_openai_client.summarize_text(transcript)
+        word_file_path = await create_word(summarized_text, file_name=f"議事録_{job_id}.docx")
+        output_name = f"{self.output_prefix}{job_id}.docx"
+        try:
+            word_data = await asyncio.to_thread(word_file_path.read_bytes)
+            await self.az_blob_client.upload_blob(output_name, word_data)
+        finally:
+            await cleanup_file(str(word_file_path))
+        if self.search_index is not None:
+            fields = {
+                key: record[key]
+                for key in ("title", "project", "project_directory", "client_id", "created_at")
+                if key in record
+            }
+            await asyncio.to_thread(self.search_index.add_document, job_id, fields, transcript, summarized_text)
+        self.stats["done"] += 1
+        self.checkpoint.record(blob_name, "done", job_id=job_id, output=output_name, tokens=estimated)
+
+    def report(self) -> str:
+        """
+        処理件数とスループットを1行で返す。
+        """
+        elapsed = max(time.monotonic() - self.started_at, 1e-9)
+        paused = self.guard.paused_seconds if self.guard is not None else 0.0
+        return (
+            f"reprocess: done={self.stats['done']} failed={self.stats['failed']} "
+            f"skipped={self.stats['skipped']} listed={self.stats['listed']} tokens={self.stats['tokens']} "
+            f"elapsed={elapsed:.0f}s paused={paused:.0f}s "
+            f"throughput={self.stats['done'] / elapsed * 60:.2f}/min "
+            f"tokens_per_minute={self.stats['tokens'] / elapsed * 60:.0f} "
+            f"token_limit_per_minute={self.bucket.tokens_per_minute:.0f}"
+        )
+
+    async def _report_loop(self, interval: float):
+        while True:
+            await asyncio.sleep(interval)
+            print(self.report())
+
+
+def parse_args(argv: list[str] | None = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="保存済みの文字起こし結果から議事録を再生成する")
+    parser.add_argument("--prefix", default=os.getenv("TRANSCRIPT_ARCHIVE_PREFIX", "transcripts/"),
+                        help="文字起こし結果が保存されているBlobのプレフィックス")
+    parser.add_argument("--output-prefix", default="minutes/", help="再生成したWordファイルのアップロード先プレフィックス")
+    parser.add_argument("--checkpoint", default="reprocess_checkpoint.jsonl", help="進捗を記録するファイル（再開時も同じものを指定）")
+    parser.add_argument("--concurrency", type=int, default=2, help="同時に処理する件数")
+    parser.add_argument("--max-openai-requests", type=int, default=4, help="OpenAIへの同時リクエスト数の上限")
+    parser.add_argument("--tokens-per-minute", type=int, default=30000, help="1分あたりのトークン消費量の上限（0で無制限）")
+    parser.add_argument("--max-tokens", type=int, default=0, help="この実行で消費するトークンの総量の上限（0で無制限）")
+    parser.add_argument("--limit", type=int, default=0, help="処理する件数の上限（0で無制限）")
+    parser.add_argument("--yield-to", default=None,
+                        help="APIの /metrics のURL。処理中のジョブが --max-live-jobs を超えている間は待機する")
+    parser.add_argument("--max-live-jobs", type=int, default=0)
+    parser.add_argument("--report-interval", type=float, default=60.0, help="スループットを出力する間隔（秒）")
+    parser.add_argument("--retry-errors", action="store_true", help="前回失敗したものも再処理する")
+    parser.add_argument("--no-index", action="store_true", help="全文検索インデックスを更新しない")
+    parser.add_argument("--index-dir", default=os.getenv("SEARCH_INDEX_DIR"),
+                        help="APIが使っている全文検索インデックスのディレクトリ（永続ボリューム上の SEARCH_INDEX_DIR）")
+    parser.add_argument("--dry-run", action="store_true", help="要約せずに件数と見積もりトークン数だけを出力する")
+    args = parser.parse_args(argv)
+    if not (args.no_index or args.dry_run or args.index_dir):
+        # 別の場所に索引を作っても /search には反映されないので、APIと同じディレクトリを必須にする
+        parser.error("--index-dir（または SEARCH_INDEX_DIR）にAPIの全文検索インデックスのディレクトリを指定するか、--no-index を指定してください")
+    return args
+
+
+async def run(args: argparse.Namespace) -> dict:
+    az_blob_client = AzBlobClient(os.getenv("AZ_BLOB_CONNECTION"), os.getenv("AZ_CONTAINER_NAME"))
+    az_openai_client = AzOpenAIClient(
+        os.getenv("AZ_OPENAI_KEY"),
+        os.getenv("AZ_OPENAI_ENDPOINT"),
+        max_concurrent_requests=args.max_openai_requests,
+    )
+    search_index = None if args.no_index or args.dry_run else SearchIndex(args.index_dir)
+    checkpoint = Checkpoint(args.checkpoint)
+    session = aiohttp.ClientSession() if args.yield_to else None
+    try:
+        guard = LiveJobGuard(session, args.yield_to, args.max_live_jobs) if session is not None else None
+        reprocessor = Reprocessor(
+            az_blob_client,
+            az_openai_client,
+            checkpoint,
+            TokenBucket(args.tokens_per_minute),
+            search_index=search_index,
+            guard=guard,
+            concurrency=args.concurrency,
+            max_total_tokens=args.max_tokens,
+            output_prefix=args.output_prefix,
+            retry_errors=args.retry_errors,
+            dry_run=args.dry_run,
+        )
+        return await reprocessor.run(args.prefix, limit=args.limit, report_interval=args.report_interval)
+    finally:
+        checkpoint.close()
+        if session is not None:
+            await session.close()
+
+
+def main(argv: list[str] | None = None):
+    load_dotenv()
+    stats = asyncio.run(run(parse_args(argv)))
+    # 失敗したものがあれば終了コードで知らせる
+    raise SystemExit(1 if stats["failed"] else 0)
+
+
+if __name__ == "__main__":
+    main()
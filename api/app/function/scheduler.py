@@ -0,0 +1,184 @@
+import asyncio
+import heapq
+import itertools
+import time
+from dataclasses import dataclass, field
+from typing import Awaitable, Callable
+from function.metrics import metrics
+
+metrics.describe("scheduler_queued_jobs", "gauge", "Jobs waiting in each scheduler lane.")
+metrics.describe("scheduler_running_jobs", "gauge", "Jobs running in each scheduler lane.")
+metrics.describe("scheduler_wait_seconds", "histogram", "Time a job waited in the scheduler before it started.")
+
+# 明示的な優先度。値が小さいほど先に処理する
+PRIORITY_RANK = {"high": 0, "normal": 1, "low": 2}
+
+
+@dataclass
+class ScheduledJob:
+    job_id: str
+    client_id: str
+    project: str
+    run: Callable[[], Awaitable[None]]
+    priority: str = "normal"
+    estimated_seconds: float | None = None
+    submitted_at: float = field(default_factory=time.monotonic)
+
+
+class _Tenant:
+    """
+    レーン内の1テナント（client_id と project の組）の待ち行列。
+    """
+    def __init__(self, weight: float):
+        self.weight = weight
+        self.virtual_time = 0.0
+        self.jobs: list[tuple[int, int, ScheduledJob]] = []
+
+
+class _Lane:
+    """
+    同時実行数の上限を持つ優先度レーン。テナント間は重み付き公平キューイングで選択する。
+    """
+    def __init__(self, name: str, concurrency: int):
+        self.name = name
+        self.concurrency = concurrency
+        self.virtual_time = 0.0
+        self.tenants: dict[tuple[str, str], _Tenant] = {}
+        self.queued = 0
+        self.running = 0
+        self.condition = asyncio.Condition()
+
+    def push(self, key: tuple[str, str], weight: float, seq: int, job: ScheduledJob):
+        tenant = self.tenants.get(key)
+        if tenant is None:
+            tenant = _Tenant(weight)
+            self.tenants[key] = tenant
+        if not tenant.jobs:
+            # 待ちが無かったテナントは現在の仮想時刻から再開させ、過去の空き時間を貯め込ませない
+            tenant.virtual_time = max(tenant.virtual_time, self.virtual_time)
+        heapq.heappush(tenant.jobs, (PRIORITY_RANK.get(job.priority, 1), seq, job))
+        self.queued += 1
+
+    def pop(self, cost: Callable[[ScheduledJob], float]) -> ScheduledJob:
+        # 待ちが無く仮想時刻も追い越されたテナントは、再投入時に同じ状態から始まるので破棄してよい
+        for key in [k for k, t in self.tenants.items() if not t.jobs and t.virtual_time <= self.virtual_time]:
+            del self.tenants[key]
+        tenant = min((t for t in self.tenants.values() if t.jobs), key=lambda t: t.virtual_time)
+        _, _, job = heapq.heappop(tenant.jobs)
+        self.virtual_time = tenant.virtual_time
+        tenant.virtual_time += cost(job) / tenant.weight
+        self.queued -= 1
+        return job
+
+
+class FairScheduler:
+    def __init__(
+        self,
+        lane_concurrency: dict[str, int] | None = None,
+        short_job_max_seconds: float = 1800,
+        weights: dict[str, float] | None = None,
+        default_seconds: float = 3600,
+    ):
+        """
+        キューから取り出したジョブを優先度レーンとテナントごとの重み付き公平配分で実行するスケジューラの初期化。
+        キューからは空きの分しか受信しないので、重み付き公平配分が選べるのは同じ受信で届いたジョブと、
+        レーンが満杯の間に待っているジョブの間だけになる。それ以外はキューに届いた順に処理する。
+
+        :param lane_concurrency: レーン名ごとの同時実行数（"short" と "long" を使用）
+        :param short_job_max_seconds: これ以下の推定時間のジョブを short レーンに振り分ける
+        :param weights: "client_id/project"、"project"、"client_id" のいずれかをキーにした重み
+        :param default_seconds: 推定時間が不明なジョブのコスト
+        """
+        lane_concurrency = lane_concurrency or {"short": 3, "long": 1}
+        self.lanes = {name: _Lane(name, n) for name, n in lane_concurrency.items()}
+        self.short_job_max_seconds = short_job_max_seconds
+        self.weights = weights or {}
+        self.default_seconds = default_seconds
+        self._seq = itertools.count()
+        self._workers: list[asyncio.Task] = []
+
+    def weight_for(self, client_id: str, project: str) -> float:
+        """
+        テナントの重みを取得する。より具体的なキーを優先する。
+        """
+        for key in (f"{client_id}/{project}", project, client_id):
+            if key in self.weights:
+                return max(float(self.weights[key]), 0.01)
+        return 1.0
+
+    def lane_for(self, job: ScheduledJob) -> str:
+        """
+        明示的な優先度、なければ推定時間からレーンを決める。
+        """
+        if job.priority == "high":
+            return "short"
+        if job.priority == "low":
+            return "long"
+        if job.estimated_seconds is not None and job.estimated_seconds <= self.short_job_max_seconds:
+            return "short"
+        return "long"
+
+    def free_slots(self) -> int:
+        """
+        キューから受信してよいメッセージの数を返す。待ちのジョブはキュー側に残しておく。
+
+        受信前にはどのレーンに入るか分からないので、空きのあるレーンの分を受信しても
+        満杯のレーンに入って待つことがある。いずれかのレーンに待ちのジョブがある間は0を返して受信を止め、
+        メモリ上の待ちが1回の受信分を超えて増えないようにする。
+        """
+        if any(lane.queued > 0 for lane in self.lanes.values()):
+            return 0
+        return sum(max(lane.concurrency - lane.running, 0) for lane in self.lanes.values())
+
+    def _cost(self, job: ScheduledJob) -> float:
+        return job.estimated_seconds if job.estimated_seconds is not None else self.default_seconds
+
+    async def submit(self, job: ScheduledJob) -> str:
+        """
+        ジョブをレーンに投入し、投入先のレーン名を返す。
+        """
+        lane = self.lanes[self.lane_for(job)]
+        async with lane.condition:
+            lane.push(
+                (job.client_id or "", job.project or ""),
+                self.weight_for(job.client_id, job.project),
+                next(self._seq),
+                job,
+            )
+            metrics.set_gauge("scheduler_queued_jobs", lane.queued, lane=lane.name)
+            lane.condition.notify()
+        return lane.name
+
+    def start(self):
+        """
+        レーンごとに同時実行数分のワーカーを起動する。
+        """
+        for lane in self.lanes.values():
+            for _ in range(lane.concurrency):
+                self._workers.append(asyncio.create_task(self._worker(lane)))
+
+    async def stop(self):
+        """
+        ワーカーを停止する。
+        """
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers.clear()
+
+    async def _worker(self, lane: _Lane):
+        while True:
+            async with lane.condition:
+                await lane.condition.wait_for(lambda: lane.queued > 0)
+                job = lane.pop(self._cost)
+                metrics.set_gauge("scheduler_queued_jobs", lane.queued, lane=lane.name)
+                lane.running += 1
+            metrics.observe("scheduler_wait_seconds", time.monotonic() - job.submitted_at, lane=lane.name)
+            metrics.add_gauge("scheduler_running_jobs", 1, lane=lane.name)
+            try:
+                await job.run()
+            except Exception as e:
+                print(f"Error in scheduled job {job.job_id}: {str(e)}")
+            finally:
+                lane.running -= 1
+                metrics.add_gauge("scheduler_running_jobs", -1, lane=lane.name)
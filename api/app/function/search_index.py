@@ -0,0 +1,359 @@
+import fcntl
+import json
+import math
+import os
+import re
+import struct
+import threading
+import time
+import unicodedata
+import uuid
+import zlib
+from array import array
+from collections import Counter
+from itertools import accumulate
+from function.metrics import metrics
+
+metrics.describe("search_query_seconds", "histogram", "Latency of full-text search queries.",
+                 buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1))
+metrics.describe("search_index_documents", "gauge", "Live documents in the search index.")
+metrics.describe("search_index_segments", "gauge", "On-disk segments in the search index.")
+
+_MAGIC = b"VRIDX1\n"
+# 英数字は単語単位、それ以外の文字（日本語など）は連続する文字列をn-gramに分割する
+_TOKEN_RE = re.compile(r"[a-z0-9]+|[^\W\d_a-z]+")
+# BM25のパラメータ
+_K1 = 1.2
+_B = 0.75
+
+
+def normalize(text: str) -> str:
+    """
+    全角・半角や大文字・小文字の違いを吸収する。
+    """
+    return unicodedata.normalize("NFKC", text).lower()
+
+
+def tokenize(text: str, for_query: bool = False) -> list[str]:
+    """
+    テキストを索引語に分割する。日本語は文字bigram（と1文字のunigram）、英数字は単語とする。
+    検索時は1文字の語だけunigramを使い、それ以外はbigramで絞り込む。
+    """
+    tokens = []
+    for match in _TOKEN_RE.finditer(normalize(text)):
+        run = match.group()
+        if run.isascii() or len(run) == 1:
+            tokens.append(run)
+            continue
+        if not for_query:
+            tokens.extend(run)
+        tokens.extend(run[i : i + 2] for i in range(len(run) - 1))
+    return tokens
+
+
+def query_phrases(query: str) -> list[str]:
+    """
+    検索語を、文書中にそのまま含まれている必要がある語句に分割する。
+    """
+    return [match.group() for match in _TOKEN_RE.finditer(normalize(query))]
+
+
+class _Segment:
+    """
+    変更されない1つのディスク上のセグメント（索引語→ポスティングと、文書本体の格納ファイル）。
+    """
+    def __init__(self, directory: str, name: str):
+        self.name = name
+        self.created_at = int(name.split("_", 1)[0])
+        with open(os.path.join(directory, name + ".idx"), "rb") as f:
+            if f.read(len(_MAGIC)) != _MAGIC:
+                raise ValueError(f"invalid segment: {name}")
+            header_size, postings_size = struct.unpack("<QQ", f.read(16))
+            header = json.loads(zlib.decompress(f.read(header_size)))
+            self.postings = zlib.decompress(f.read(postings_size))
+        self.docs: list[dict] = header["docs"]
+        self.terms: dict[str, list[int]] = header["terms"]
+        # 文書本体は必要になった時だけ読む。マージでファイルが削除されても読めるよう、
+        # このセグメントを参照する検索が無くなる（オブジェクトが回収される）まで開いたままにする
+        self.text_file = open(os.path.join(directory, name + ".txt"), "rb")
+        self._cache: dict[str, tuple[list[int], array]] = {}
+        self._lock = threading.Lock()
+
+    def postings_for(self, term: str) -> tuple[list[int], array] | None:
+        entry = self.terms.get(term)
+        if entry is None:
+            return None
+        cached = self._cache.get(term)
+        if cached is not None:
+            return cached
+        offset, count = entry
+        deltas = array("I")
+        deltas.frombytes(self.postings[offset : offset + 4 * count])
+        tfs = array("H")
+        tfs.frombytes(self.postings[offset + 4 * count : offset + 6 * count])
+        result = (list(accumulate(deltas)), tfs)
+        if len(self._cache) < 4096:
+            self._cache[term] = result
+        return result
+
+    def read_text(self, doc_num: int) -> dict:
+        doc = self.docs[doc_num]
+        with self._lock:
+            self.text_file.seek(doc["text_offset"])
+            data = self.text_file.read(doc["text_size"])
+        return json.loads(zlib.decompress(data))
+
+    def __del__(self):
+        text_file = getattr(self, "text_file", None)
+        if text_file is not None:
+            text_file.close()
+
+
+def _write_segment(directory: str, name: str, docs: list[tuple[dict, dict, Counter]]):
+    """
+    文書のリスト（メタデータ, 本文, 索引語の出現回数）から新しいセグメントを書き出す。
+    一時ファイルに書いてから名前を変えるので、途中の状態が読まれることはない。
+    """
+    postings_lists: dict[str, list[tuple[int, int]]] = {}
+    doc_headers = []
+    text_chunks = []
+    text_offset = 0
+    for doc_num, (meta, texts, term_counts) in enumerate(docs):
+        compressed = zlib.compress(json.dumps(texts, ensure_ascii=False).encode("utf-8"))
+        text_chunks.append(compressed)
+        doc_headers.append({**meta, "text_offset": text_offset, "text_size": len(compressed)})
+        text_offset += len(compressed)
+        for term, tf in term_counts.items():
+            postings_lists.setdefault(term, []).append((doc_num, min(tf, 65535)))
+
+    terms = {}
+    postings = bytearray()
+    for term in sorted(postings_lists):
+        entries = postings_lists[term]
+        doc_nums = [doc_num for doc_num, _ in entries]
+        # 文書番号は差分で持ち、zlibで圧縮しやすくする
+        deltas = array("I", [doc_nums[0]] + [b - a for a, b in zip(doc_nums, doc_nums[1:])])
+        tfs = array("H", [tf for _, tf in entries])
+        terms[term] = [len(postings), len(entries)]
+        postings += deltas.tobytes()
+        postings += tfs.tobytes()
+
+    header = zlib.compress(json.dumps({"docs": doc_headers, "terms": terms}, ensure_ascii=False).encode("utf-8"))
+    postings_data = zlib.compress(bytes(postings))
+    tmp_suffix = f".tmp{os.getpid()}"
+    with open(os.path.join(directory, name + ".txt" + tmp_suffix), "wb") as f:
+        for chunk in text_chunks:
+            f.write(chunk)
+    with open(os.path.join(directory, name + ".idx" + tmp_suffix), "wb") as f:
+        f.write(_MAGIC)
+        f.write(struct.pack("<QQ", len(header), len(postings_data)))
+        f.write(header)
+        f.write(postings_data)
+    # .txt を先に公開し、.idx の公開をもってセグメントを有効にする
+    os.replace(os.path.join(directory, name + ".txt" + tmp_suffix), os.path.join(directory, name + ".txt"))
+    os.replace(os.path.join(directory, name + ".idx" + tmp_suffix), os.path.join(directory, name + ".idx"))
+
+
+class SearchIndex:
+    def __init__(self, index_dir: str, merge_factor: int = 8):
+        """
+        議事録と文字起こしの全文検索用の転置インデックスの初期化。
+
+        文書を追加するたびに小さなセグメントを書き出し、同程度の大きさのセグメントが
+        merge_factor 個たまったら1つにマージする。同じディレクトリを複数のプロセスで共有できる。
+        """
+        self.index_dir = index_dir
+        self.merge_factor = merge_factor
+        os.makedirs(index_dir, exist_ok=True)
+        self._lock = threading.RLock()
+        self._segments: dict[str, _Segment] = {}
+        self._live: dict[str, tuple[str, int]] = {}
+        self._total_length = 0
+        self.refresh()
+
+    def _segment_names(self) -> list[str]:
+        return sorted(name[:-4] for name in os.listdir(self.index_dir) if name.endswith(".idx"))
+
+    def refresh(self):
+        """
+        ディレクトリ上のセグメント一覧を読み直す（他のプロセスによる追加・マージを反映する）。
+        """
+        with self._lock:
+            names = self._segment_names()
+            if names == list(self._segments):
+                return
+            segments = {}
+            for name in names:
+                segment = self._segments.get(name)
+                if segment is None:
+                    try:
+                        segment = _Segment(self.index_dir, name)
+                    except FileNotFoundError:
+                        # 読み込み中に他のプロセスのマージで消えた
+                        continue
+                segments[name] = segment
+            # 同じdoc_idが複数のセグメントにある場合は新しいセグメントのものを有効とする
+            live = {}
+            for name, segment in segments.items():
+                for doc_num, doc in enumerate(segment.docs):
+                    live[doc["doc_id"]] = (name, doc_num)
+            # 外れたセグメントは閉じない。検索中のスナップショットがまだ参照していることがあり、
+            # 参照が無くなった時点でファイルも閉じられる
+            self._segments = segments
+            self._live = live
+            self._total_length = sum(segments[name].docs[num]["length"] for name, num in live.values())
+            metrics.set_gauge("search_index_documents", len(live))
+            metrics.set_gauge("search_index_segments", len(segments))
+
+    def _file_lock(self):
+        return open(os.path.join(self.index_dir, ".lock"), "w")
+
+    @staticmethod
+    def _new_name(created_at: int | None = None) -> str:
+        return f"{created_at or time.time_ns():020d}_{uuid.uuid4().hex[:8]}"
+
+    def add_document(self, doc_id: str, fields: dict, transcript: str, summary: str):
+        """
+        文書を追加する。同じdoc_idの文書が既にあれば置き換える。
+        """
+        # 要約は文字起こしより重要なので、出現回数を2倍に数える
+        term_counts = Counter(tokenize(transcript))
+        for term, count in Counter(tokenize(summary)).items():
+            term_counts[term] += count * 2
+        meta = {"doc_id": doc_id, "fields": fields, "length": sum(term_counts.values())}
+        texts = {"summary": summary, "transcript": transcript}
+        with self._lock, self._file_lock() as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            _write_segment(self.index_dir, self._new_name(), [(meta, texts, term_counts)])
+            self.refresh()
+            self._maybe_merge()
+
+    def _level(self, segment: _Segment) -> int:
+        return int(math.log(max(len(segment.docs), 1), self.merge_factor))
+
+    def _maybe_merge(self):
+        """
+        同じ大きさの段階のセグメントが merge_factor 個以上あればマージする（ファイルロック取得済みで呼ぶ）。
+        """
+        while True:
+            levels: dict[int, list[_Segment]] = {}
+            for segment in self._segments.values():
+                levels.setdefault(self._level(segment), []).append(segment)
+            targets = next((group for group in levels.values() if len(group) >= self.merge_factor), None)
+            if targets is None:
+                return
+            self._merge(targets)
+
+    def _merge(self, targets: list[_Segment]):
+        docs = []
+        for segment in targets:
+            for doc_num, doc in enumerate(segment.docs):
+                # 新しいセグメントで置き換えられた文書はここで捨てる
+                if self._live.get(doc["doc_id"]) != (segment.name, doc_num):
+                    continue
+                term_counts = Counter()
+                texts = segment.read_text(doc_num)
+                term_counts.update(tokenize(texts["transcript"]))
+                for term, count in Counter(tokenize(texts["summary"])).items():
+                    term_counts[term] += count * 2
+                meta = {key: doc[key] for key in ("doc_id", "fields", "length")}
+                docs.append((meta, texts, term_counts))
+        # 新旧の判定が変わらないよう、マージ後のセグメントは入力のうち最も新しい時刻を引き継ぐ
+        name = self._new_name(max(segment.created_at for segment in targets))
+        if docs:
+            _write_segment(self.index_dir, name, docs)
+        for segment in targets:
+            for suffix in (".idx", ".txt"):
+                try:
+                    os.remove(os.path.join(self.index_dir, segment.name + suffix))
+                except FileNotFoundError:
+                    pass
+        self.refresh()
+
+    def search(self, query: str, limit: int = 20, project: str | None = None) -> list[dict]:
+        """
+        全ての検索語を含む文書をBM25でスコア付けし、スコアの高い順に返す。
+        """
+        started = time.perf_counter()
+        self.refresh()
+        with self._lock:
+            segments = dict(self._segments)
+            live = dict(self._live)
+            total_length = self._total_length
+        terms = list(dict.fromkeys(tokenize(query, for_query=True)))
+        phrases = query_phrases(query)
+        if not terms or not live:
+            return []
+
+        # 検索語ごと・セグメントごとのポスティングを取得し、全ての語を含む文書に絞り込む
+        per_segment: dict[str, dict[int, list[int]]] = {}
+        document_frequency = Counter()
+        for name, segment in segments.items():
+            postings = [segment.postings_for(term) for term in terms]
+            if any(p is None for p in postings):
+                continue
+            for term, (doc_nums, _) in zip(terms, postings):
+                document_frequency[term] += len(doc_nums)
+            order = sorted(range(len(terms)), key=lambda i: len(postings[i][0]))
+            candidates = None
+            for i in order:
+                doc_set = set(postings[i][0])
+                candidates = doc_set if candidates is None else candidates & doc_set
+                if not candidates:
+                    break
+            if not candidates:
+                continue
+            tf_by_doc = {doc_num: [] for doc_num in candidates}
+            for doc_nums, tfs in postings:
+                for doc_num, tf in zip(doc_nums, tfs):
+                    if doc_num in tf_by_doc:
+                        tf_by_doc[doc_num].append(tf)
+            per_segment[name] = tf_by_doc
+
+        n_docs = len(live)
+        avg_length = total_length / n_docs if n_docs else 1.0
+        idf = [math.log(1 + (n_docs - document_frequency[t] + 0.5) / (document_frequency[t] + 0.5)) for t in terms]
+        scored = []
+        for name, tf_by_doc in per_segment.items():
+            segment = segments[name]
+            for doc_num, tfs in tf_by_doc.items():
+                doc = segment.docs[doc_num]
+                if live.get(doc["doc_id"]) != (name, doc_num):
+                    continue
+                if project is not None and doc["fields"].get("project") != project:
+                    continue
+                norm = _K1 * (1 - _B + _B * doc["length"] / avg_length)
+                score = sum(w * tf * (_K1 + 1) / (tf + norm) for w, tf in zip(idf, tfs))
+                scored.append((score, name, doc_num))
+        scored.sort(reverse=True)
+
+        # n-gramの一致だけでは語順が保証されないので、上位から本文に語句が含まれるか確認する
+        results = []
+        for score, name, doc_num in scored:
+            segment = segments[name]
+            texts = segment.read_text(doc_num)
+            summary = normalize(texts["summary"])
+            transcript = normalize(texts["transcript"])
+            if not all(phrase in summary or phrase in transcript for phrase in phrases):
+                continue
+            doc = segment.docs[doc_num]
+            results.append({
+                "doc_id": doc["doc_id"],
+                "score": round(score, 4),
+                **doc["fields"],
+                "snippet": self._snippet(summary, transcript, phrases[0]),
+            })
+            if len(results) >= limit:
+                break
+        metrics.observe("search_query_seconds", time.perf_counter() - started)
+        return results
+
+    @staticmethod
+    def _snippet(summary: str, transcript: str, phrase: str, width: int = 60) -> str:
+        for text in (summary, transcript):
+            position = text.find(phrase)
+            if position >= 0:
+                start = max(position - width, 0)
+                end = min(position + len(phrase) + width, len(text))
+                return ("…" if start else "") + text[start:end] + ("…" if end < len(text) else "")
+        return summary[: width * 2]
@@ -1,6 +1,10 @@
-import msal
-import requests
+from __future__ import annotations
 from functools import cache
+from typing import TYPE_CHECKING
+from function.startup_profile import lazy_import
+
+if TYPE_CHECKING:
+    import requests
 
 class SharePointAccessClass:
     # 初期化
@@ -23,6 +27,7 @@ class SharePointAccessClass:
         """
         # Create a confidential client application using msal library
         """msalを使用してアクセストークンを取得します"""
+        msal = lazy_import("msal")
         app = msal.ConfidentialClientApplication(
             self.client_id,
             authority=self.authority,
@@ -42,7 +47,7 @@ class SharePointAccessClass:
         Get data from Graph API using the endpoint
         """
         if self.access_token is not None:
-            graph_data = requests.get(
+            graph_data = lazy_import("requests").get(
                 endpoint,
                 headers={'Authorization': 'Bearer ' + self.access_token})
             return graph_data
@@ -55,7 +60,7 @@ class SharePointAccessClass:
         Post data to Graph API using the endpoint
         """
         if self.access_token is not None:
-            graph_data = requests.put(
+            graph_data = lazy_import("requests").put(
                 url=endpoint,
                 headers={'Authorization': 'Bearer ' + self.access_token},
                 data=data)
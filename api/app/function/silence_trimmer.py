@@ -0,0 +1,155 @@
+import bisect
+import struct
+import numpy as np
+from fastapi import HTTPException
+
+# 1ブロックで解析するフレーム数（メモリマップを少しずつ読み込むための単位）
+_BLOCK_FRAMES = 65536
+
+
+def read_wav_layout(path: str) -> dict:
+    """
+    WAVファイルのヘッダを解析し、PCMデータの位置とフォーマットを返す。
+    """
+    with open(path, "rb") as f:
+        header = f.read(12)
+        if len(header) < 12 or header[:4] != b"RIFF" or header[8:12] != b"WAVE":
+            raise HTTPException(status_code=500, detail="Invalid WAV file")
+        layout = {}
+        while True:
+            chunk_header = f.read(8)
+            if len(chunk_header) < 8:
+                break
+            chunk_id, chunk_size = struct.unpack("<4sI", chunk_header)
+            if chunk_id == b"fmt ":
+                fmt = f.read(chunk_size)
+                audio_format, channels, sample_rate, _, _, bits = struct.unpack_from("<HHIIHH", fmt)
+                layout.update(audio_format=audio_format, channels=channels, sample_rate=sample_rate, bits=bits)
+                if chunk_size & 1:
+                    f.seek(1, 1)
+            elif chunk_id == b"data":
+                layout.update(data_offset=f.tell(), data_size=chunk_size)
+                break
+            else:
+                f.seek(chunk_size + (chunk_size & 1), 1)
+    if "data_offset" not in layout or "sample_rate" not in layout:
+        raise HTTPException(status_code=500, detail="WAV file has no fmt/data chunk")
+    return layout
+
+
+def frame_energy_db(samples: np.ndarray, frame_length: int) -> np.ndarray:
+    """
+    フレームごとの平均二乗エネルギーをdBFSで返す。ブロック単位で計算し、全体をメモリに載せない。
+    """
+    n_frames = len(samples) // frame_length
+    energy = np.empty(n_frames, dtype=np.float32)
+    for start in range(0, n_frames, _BLOCK_FRAMES):
+        stop = min(start + _BLOCK_FRAMES, n_frames)
+        block = np.asarray(samples[start * frame_length : stop * frame_length], dtype=np.float32)
+        block = block.reshape(stop - start, frame_length) / 32768.0
+        energy[start:stop] = np.mean(block * block, axis=1)
+    return 10.0 * np.log10(energy + 1e-12)
+
+
+def find_keep_ranges(
+    energy_db: np.ndarray,
+    threshold_db: float,
+    min_silence_frames: int,
+    keep_silence_frames: int,
+) -> list[tuple[int, int]]:
+    """
+    長い無音区間を短く詰めた後に残すフレーム範囲 [start, end) の一覧を返す。
+    無音区間の前後には keep_silence_frames の半分ずつを残し、発話の切れ目を自然に保つ。
+    """
+    silent = energy_db < threshold_db
+    # 無音区間の開始・終了位置を差分から求める
+    edges = np.diff(np.concatenate(([0], silent.astype(np.int8), [0])))
+    starts = np.flatnonzero(edges == 1)
+    ends = np.flatnonzero(edges == -1)
+    long_runs = (ends - starts) >= max(min_silence_frames, keep_silence_frames + 1)
+    head = keep_silence_frames // 2
+    tail = keep_silence_frames - head
+
+    keep_ranges = []
+    cursor = 0
+    for run_start, run_end in zip(starts[long_runs], ends[long_runs]):
+        cut_start = run_start + head
+        cut_end = run_end - tail
+        if cut_start > cursor:
+            keep_ranges.append((cursor, int(cut_start)))
+        cursor = int(cut_end)
+    if cursor < len(energy_db):
+        keep_ranges.append((cursor, len(energy_db)))
+    return keep_ranges
+
+
+def _wav_header(data_size: int, sample_rate: int, channels: int, bits: int) -> bytes:
+    block_align = channels * bits // 8
+    return struct.pack(
+        "<4sI4s4sIHHIIHH4sI",
+        b"RIFF", 36 + data_size, b"WAVE",
+        b"fmt ", 16, 1, channels, sample_rate, sample_rate * block_align, block_align, bits,
+        b"data", data_size,
+    )
+
+
+def trim_silence(
+    input_path: str,
+    output_path: str,
+    threshold_db: float = -45.0,
+    min_silence_seconds: float = 2.0,
+    keep_silence_seconds: float = 0.5,
+    frame_ms: int = 30,
+) -> list[tuple[float, float, float]] | None:
+    """
+    16-bitモノラルPCMのWAVから長い無音を詰めたWAVを作成し、オフセットマップを返す。
+    オフセットマップは (詰めた後の開始秒, 元の開始秒, 長さ秒) のリスト。
+    詰める区間が無い場合は出力せずNoneを返す。
+    """
+    layout = read_wav_layout(input_path)
+    if layout["audio_format"] != 1 or layout["channels"] != 1 or layout["bits"] != 16:
+        return None
+    sample_rate = layout["sample_rate"]
+    n_samples = layout["data_size"] // 2
+    if n_samples == 0:
+        return None
+    samples = np.memmap(input_path, dtype="<i2", mode="r", offset=layout["data_offset"], shape=(n_samples,))
+    frame_length = max(int(sample_rate * frame_ms / 1000), 1)
+    energy_db = frame_energy_db(samples, frame_length)
+    keep_ranges = find_keep_ranges(
+        energy_db,
+        threshold_db,
+        int(min_silence_seconds * 1000 / frame_ms),
+        int(keep_silence_seconds * 1000 / frame_ms),
+    )
+    # 端数のサンプルは最後の区間に含める
+    if keep_ranges and keep_ranges[-1][1] == len(energy_db):
+        sample_ranges = [(s * frame_length, e * frame_length) for s, e in keep_ranges[:-1]]
+        sample_ranges.append((keep_ranges[-1][0] * frame_length, n_samples))
+    else:
+        sample_ranges = [(s * frame_length, e * frame_length) for s, e in keep_ranges]
+    kept = sum(e - s for s, e in sample_ranges)
+    if kept >= n_samples:
+        return None
+
+    offset_map = []
+    trimmed_position = 0
+    with open(output_path, "wb") as out:
+        out.write(_wav_header(kept * 2, sample_rate, 1, 16))
+        for start, end in sample_ranges:
+            out.write(samples[start:end].tobytes())
+            offset_map.append((trimmed_position / sample_rate, start / sample_rate, (end - start) / sample_rate))
+            trimmed_position += end - start
+    del samples
+    return offset_map
+
+
+def map_to_original(seconds: float, offset_map: list[tuple[float, float, float]] | None) -> float:
+    """
+    無音を詰めた音声上の時刻を、元の録音上の時刻に変換する。
+    """
+    if not offset_map:
+        return seconds
+    index = bisect.bisect_right([segment[0] for segment in offset_map], seconds) - 1
+    trimmed_start, original_start, _ = offset_map[max(index, 0)]
+    return original_start + (seconds - trimmed_start)
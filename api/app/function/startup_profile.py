@@ -0,0 +1,63 @@
+import importlib
+import os
+import time
+from function.metrics import metrics
+
+metrics.describe("startup_seconds", "gauge", "Seconds from process start until each startup phase completed.")
+metrics.describe("lazy_import_seconds", "gauge", "Time spent importing each lazily loaded module.")
+
+_CLOCK_TICKS = os.sysconf("SC_CLK_TCK") if hasattr(os, "sysconf") else 100
+
+
+def _process_started_at() -> float:
+    """
+    プロセスの開始時刻（UNIX時間）を返す。/proc が使えない環境ではこのモジュールの読み込み時刻とする。
+    """
+    try:
+        with open("/proc/self/stat") as f:
+            # comm に空白が含まれても良いよう、最後の ")" より後ろを分割する
+            fields = f.read().rsplit(")", 1)[1].split()
+        start_ticks = int(fields[19])
+        with open("/proc/stat") as f:
+            boot_time = next(int(line.split()[1]) for line in f if line.startswith("btime"))
+        return boot_time + start_ticks / _CLOCK_TICKS
+    except (OSError, IndexError, ValueError, StopIteration):
+        return time.time()
+
+
+PROCESS_STARTED_AT = _process_started_at()
+_phases: dict[str, float] = {}
+_imports: dict[str, float] = {}
+
+
+def mark(phase: str):
+    """
+    起動フェーズの完了時刻を記録する。
+    """
+    elapsed = time.time() - PROCESS_STARTED_AT
+    _phases[phase] = elapsed
+    metrics.set_gauge("startup_seconds", elapsed, phase=phase)
+
+
+def lazy_import(module_name: str):
+    """
+    モジュールを初回利用時に読み込み、読み込みにかかった時間を記録する。
+    """
+    started = time.perf_counter()
+    module = importlib.import_module(module_name)
+    if module_name not in _imports:
+        elapsed = time.perf_counter() - started
+        _imports[module_name] = elapsed
+        metrics.set_gauge("lazy_import_seconds", elapsed, module=module_name)
+    return module
+
+
+def report() -> dict:
+    """
+    起動時間のレポートを返す。
+    """
+    return {
+        "process_started_at": PROCESS_STARTED_AT,
+        "phases": dict(sorted(_phases.items(), key=lambda item: item[1])),
+        "lazy_imports": dict(sorted(_imports.items(), key=lambda item: -item[1])),
+    }
@@ -1,7 +1,17 @@
 import asyncio
-from openai import AsyncAzureOpenAI
-import tiktoken
+import functools
+import time
 from fastapi import HTTPException
+from function.metrics import metrics
+from function.startup_profile import lazy_import
+
+@functools.cache
+def get_encoding():
+    """
+    tiktokenのエンコーディングを取得する（プロセス内で1回だけ読み込む）。
+    TIKTOKEN_CACHE_DIR にBPEファイルを置いておけば初回のダウンロードも発生しない。
+    """
+    return lazy_import("tiktoken").encoding_for_model("gpt-4o")
 
 class AzOpenAIClient:
     def __init__(
@@ -14,12 +24,13 @@ class AzOpenAIClient:
         """
         OpenAI サマライズ用クラスの初期化。
         """
-        self.client = AsyncAzureOpenAI(
+        openai = lazy_import("openai")
+        self.client = openai.AsyncAzureOpenAI(
             api_key=az_openai_key,
             azure_endpoint=az_openai_endpoint,
             api_version=api_version,
         )
-        self.encoding = tiktoken.encoding_for_model("gpt-4o")
+        self.encoding = get_encoding()
         self.semaphore = asyncio.Semaphore(
             max_concurrent_requests
         )  # 同時リクエスト数を制限
@@ -39,6 +50,7 @@ class AzOpenAIClient:
         GPTモデルにチャンクを投げて要約を取得。
         """
         async with self.semaphore:
+            started = time.perf_counter()
             try:
                 response = await self.client.chat.completions.create(
                     model="gpt-4o",
@@ -76,8 +88,19 @@ class AzOpenAIClient:
                         },
                     ],
                 )
+                metrics.observe("openai_request_duration_seconds", time.perf_counter() - started, status="success")
+                if response.usage is not None:
+                    metrics.inc("openai_tokens_total", response.usage.prompt_tokens, kind="prompt")
+                    metrics.inc("openai_tokens_total", response.usage.completion_tokens, kind="completion")
                 return response.choices[0].message.content.strip()
             except Exception as e:
+                # openai.RateLimitError は status_code が 429 になる
+                if getattr(e, "status_code", None) == 429:
+                    metrics.inc("http_429_total", service="openai")
+                    status = "rate_limited"
+                else:
+                    status = "error"
+                metrics.observe("openai_request_duration_seconds", time.perf_counter() - started, status=status)
                 raise HTTPException(status_code=500, detail=f"エラー: {str(e)}")
 
     async def run_in_batches(self, tasks: list, batch_size: int = 5) -> list:
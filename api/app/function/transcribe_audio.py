@@ -1,24 +1,33 @@
 import asyncio
+import time
 import aiohttp
 from fastapi import HTTPException
+from function.metrics import metrics
 
 class AzTranscriptionClient:
-    def __init__(self, session: aiohttp.ClientSession, az_speech_key: str, az_speech_endpoint: str):
+    # ポーリングの待ち時間の目安（最低待ち時間と、音声の長さに対する比率）
+    MIN_WAIT_SECONDS = 300
+    WAIT_RATIO = 0.5
+
+    def __init__(self, session: aiohttp.ClientSession, az_speech_key: str, az_speech_endpoint: str, batcher=None):
         self.headers = {
             "Ocp-Apim-Subscription-Key": az_speech_key,
             "Content-Type": "application/json",
         }
         self.az_speech_endpoint = az_speech_endpoint
         self.session = session
+        # 複数の録音をまとめて1つのジョブで文字起こしするバッチャー（未指定なら1件ずつ処理）
+        self.batcher = batcher
 
     async def close(self):
         await self.session.close()
 
-    async def create_transcription_job(self, blob_url: str) -> str:
+    async def create_transcription_job(self, blob_url: str | list[str]) -> str:
+        content_urls = [blob_url] if isinstance(blob_url, str) else list(blob_url)
         body = {
             "displayName": "Transcription",
             "locale": "ja-jp",
-            "contentUrls": [blob_url],
+            "contentUrls": content_urls,
             "properties": {
                 "diarizationEnabled": True,
                 "punctuationMode": "DictatedAndAutomatic",
@@ -29,6 +38,8 @@ class AzTranscriptionClient:
         async with self.session.post(
             transcription_url, headers=self.headers, json=body
         ) as response:
+            if response.status == 429:
+                metrics.inc("http_429_total", service="speech")
             if response.status != 201:
                 raise HTTPException(
                     status_code=response.status,
@@ -40,13 +51,22 @@ class AzTranscriptionClient:
         self, job_url: str, max_attempts=30, initial_interval=2
     ) -> str:
         interval = initial_interval
+        started = time.perf_counter()
         for attempt in range(max_attempts):
             async with self.session.get(job_url, headers=self.headers) as response:
+                if response.status == 429:
+                    # レート制限中は状態を取得できないので次の試行まで待つ
+                    metrics.inc("http_429_total", service="speech")
+                    await asyncio.sleep(interval)
+                    interval = min(interval * 2, 10)
+                    continue
                 status_data = await response.json()
                 #print(f"Attempt {attempt + 1}: Response JSON: {status_data}")
                 if status_data["status"] == "Succeeded":
+                    metrics.observe("speech_job_wait_seconds", time.perf_counter() - started, status="succeeded")
                     return status_data["links"]["files"]
                 elif status_data["status"] in ["Failed", "Cancelled"]:
+                    metrics.observe("speech_job_wait_seconds", time.perf_counter() - started, status="failed")
                     raise HTTPException(
                         status_code=500,
                         detail=f"ジョブの進行に失敗しました: {status_data['status']}",
@@ -55,30 +75,71 @@ class AzTranscriptionClient:
             interval = min(interval * 2, 10)  # 最大10秒まで間隔を増加
         raise HTTPException(status_code=500, detail="ジョブのタイムアウト")
 
+    def poll_attempts_for(self, duration_seconds: float | None, initial_interval=2, max_interval=10) -> int:
+        """
+        音声の長さからポーリングの試行回数を決める。長さが不明な場合は従来の30回とする。
+        """
+        if not duration_seconds:
+            return 30
+        deadline = self.MIN_WAIT_SECONDS + duration_seconds * self.WAIT_RATIO
+        attempts, waited, interval = 0, 0.0, initial_interval
+        while waited < deadline:
+            waited += interval
+            interval = min(interval * 2, max_interval)
+            attempts += 1
+        return max(attempts, 30)
+
+    async def get_transcription_files(self, file_url: str) -> list[str]:
+        """
+        ジョブの結果ファイル一覧から、文字起こし結果（kind が Transcription）の contentUrl を全て取得する。
+        """
+        content_urls = []
+        next_url = file_url
+        while next_url:
+            async with self.session.get(next_url, headers=self.headers) as response:
+                if response.status == 429:
+                    metrics.inc("http_429_total", service="speech")
+                if response.status != 200:
+                    raise HTTPException(
+                        status_code=response.status,
+                        detail=f"結果の取得に失敗しました: {await response.text()}",
+                    )
+                files_data = await response.json()
+            content_urls.extend(
+                value["links"]["contentUrl"]
+                for value in files_data["values"]
+                if value.get("kind") == "Transcription"
+            )
+            next_url = files_data.get("@nextLink")
+        return content_urls
+
     async def get_transcription_result(self, file_url: str) -> str:
-        async with self.session.get(file_url, headers=self.headers) as response:
-            if response.status != 200:
-                raise HTTPException(
-                    status_code=response.status,
-                    detail=f"結果の取得に失敗しました: {await response.text()}",
-                )
-            files_data = await response.json()
-            return files_data["values"][0]["links"]["contentUrl"]
+        content_urls = await self.get_transcription_files(file_url)
+        if not content_urls:
+            raise HTTPException(status_code=500, detail="文字起こし結果が見つかりません")
+        return content_urls[0]
 
-    async def fetch_transcription_display(self, content_url: str) -> str:
+    async def fetch_transcription_content(self, content_url: str) -> dict:
         async with self.session.get(content_url) as response:
             if response.status != 200:
                 raise HTTPException(
                     status_code=response.status,
                     detail=f"contentUrl の取得に失敗しました: {await response.text()}",
                 )
-            content_data = await response.json()
-            return content_data["combinedRecognizedPhrases"][0]["display"]
+            return await response.json()
+
+    async def fetch_transcription_display(self, content_url: str) -> str:
+        content_data = await self.fetch_transcription_content(content_url)
+        return content_data["combinedRecognizedPhrases"][0]["display"]
 
-    async def transcribe_audio(self, blob_url: str) -> str:
+    async def transcribe_audio(self, blob_url: str, duration_seconds: float | None = None) -> str:
+        if self.batcher is not None:
+            return await self.batcher.transcribe(blob_url, duration_seconds)
         if self.session.closed:
             self.session = aiohttp.ClientSession()
         job_url = await self.create_transcription_job(blob_url)
-        file_url = await self.poll_transcription_status(job_url)
+        file_url = await self.poll_transcription_status(
+            job_url, max_attempts=self.poll_attempts_for(duration_seconds)
+        )
         content_url = await self.get_transcription_result(file_url)
         return await self.fetch_transcription_display(content_url)
@@ -0,0 +1,46 @@
+import json
+from datetime import datetime, timezone
+from function.blob_processor import AzBlobClient
+
+# 保存形式を変えた場合に古い記録と区別するためのバージョン
+RECORD_VERSION = 1
+
+
+def transcript_blob_name(prefix: str, job_id: str) -> str:
+    """
+    文字起こし結果を保存するBlob名を返す。
+    """
+    return f"{prefix}{job_id}.json"
+
+
+async def archive_transcript(
+    az_blob_client: AzBlobClient,
+    prefix: str,
+    job_id: str,
+    metadata: dict,
+    transcript: str,
+) -> str:
+    """
+    文字起こし結果をメタデータと一緒にBlobへ保存する。後から要約だけを作り直すときに使う。
+    無音を詰めた場合はメタデータに offset_map を含めておけば、
+    silence_trimmer.map_to_original で文字起こし上の時刻を元の録音の時刻に戻せる。
+    """
+    record = {
+        "version": RECORD_VERSION,
+        "job_id": job_id,
+        "archived_at": datetime.now(timezone.utc).isoformat(),
+        **metadata,
+        "transcript": transcript,
+    }
+    data = json.dumps(record, ensure_ascii=False).encode("utf-8")
+    return await az_blob_client.upload_blob(transcript_blob_name(prefix, job_id), data)
+
+
+def parse_transcript_record(data: bytes) -> dict:
+    """
+    保存した文字起こし結果を読み込む。
+    """
+    record = json.loads(data)
+    if not isinstance(record, dict) or not isinstance(record.get("transcript"), str):
+        raise ValueError("invalid transcript record")
+    return record
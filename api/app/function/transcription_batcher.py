@@ -0,0 +1,136 @@
+import asyncio
+import aiohttp
+from urllib.parse import urlparse, unquote
+from fastapi import HTTPException
+from function.metrics import metrics
+from function.transcribe_audio import AzTranscriptionClient
+
+metrics.describe(
+    "speech_batch_size",
+    "histogram",
+    "Recordings submitted per Speech batch transcription job.",
+    buckets=(1, 2, 4, 8, 16, 32, 64),
+)
+metrics.describe("speech_jobs_created_total", "counter", "Speech batch transcription jobs created.")
+
+
+def normalize_content_url(url: str) -> str:
+    """
+    SASトークンやエンコードの違いを無視して比較できるよう、URLをスキーム・ホスト・パスに正規化する。
+    """
+    parsed = urlparse(url)
+    return f"{parsed.scheme.lower()}://{parsed.netloc.lower()}{unquote(parsed.path)}"
+
+
+class TranscriptionBatcher:
+    def __init__(
+        self,
+        client: AzTranscriptionClient,
+        window_seconds: float = 2.0,
+        max_batch_size: int = 20,
+        short_job_max_seconds: float = 1800,
+    ):
+        """
+        短い時間窓の間に届いた録音をまとめ、1つのSpeechバッチ文字起こしジョブとして投入するクラスの初期化。
+        ジョブ内の全録音の結果は最も長い録音が終わるまで返らないので、長さの区分ごとに別のバッチにまとめる。
+
+        :param client: ジョブの作成・ポーリングに使うクライアント
+        :param window_seconds: 最初の録音が届いてからジョブを投入するまで待つ秒数
+        :param max_batch_size: 1ジョブにまとめる録音の最大数（到達したら即時投入）
+        :param short_job_max_seconds: これ以下の長さの録音を短い録音としてまとめる（スケジューラの short レーンと同じ閾値）
+        """
+        self.client = client
+        self.window_seconds = window_seconds
+        self.max_batch_size = max_batch_size
+        self.short_job_max_seconds = short_job_max_seconds
+        self._pending: dict[str, list[tuple[str, float | None, asyncio.Future]]] = {}
+        self._timers: dict[str, asyncio.TimerHandle] = {}
+        self._tasks: set[asyncio.Task] = set()
+
+    def duration_class(self, duration_seconds: float | None) -> str:
+        """
+        録音の長さの区分を返す。長さが不明な録音は短い録音と同じバッチに入れない。
+        """
+        if not duration_seconds:
+            return "unknown"
+        if duration_seconds <= self.short_job_max_seconds:
+            return "short"
+        return "long"
+
+    async def transcribe(self, blob_url: str, duration_seconds: float | None = None) -> str:
+        """
+        録音を同じ長さの区分のバッチに追加し、そのジョブの中から自分の結果が返るまで待つ。
+        """
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        key = self.duration_class(duration_seconds)
+        pending = self._pending.setdefault(key, [])
+        pending.append((blob_url, duration_seconds, future))
+        if len(pending) >= self.max_batch_size:
+            self._flush(key)
+        elif key not in self._timers:
+            self._timers[key] = loop.call_later(self.window_seconds, self._flush, key)
+        return await future
+
+    def _flush(self, key: str):
+        """
+        区分ごとに溜まっている録音を1つのジョブとして投入する。
+        """
+        timer = self._timers.pop(key, None)
+        if timer is not None:
+            timer.cancel()
+        batch = self._pending.pop(key, [])
+        if not batch:
+            return
+        task = asyncio.create_task(self._run_batch(batch))
+        # タスクがGCされないよう完了まで参照を保持する
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _run_batch(self, batch: list[tuple[str, float | None, asyncio.Future]]):
+        waiters: dict[str, list[asyncio.Future]] = {}
+        for blob_url, _, future in batch:
+            waiters.setdefault(normalize_content_url(blob_url), []).append(future)
+        try:
+            client = self.client
+            if client.session.closed:
+                client.session = aiohttp.ClientSession()
+            blob_urls = list(dict.fromkeys(blob_url for blob_url, _, _ in batch))
+            metrics.observe("speech_batch_size", len(blob_urls))
+            metrics.inc("speech_jobs_created_total")
+            job_url = await client.create_transcription_job(blob_urls)
+            # ジョブ全体の待ち時間は最も長い録音に合わせる
+            durations = [d for _, d, _ in batch if d]
+            longest = max(durations) if len(durations) == len(batch) else None
+            files_url = await client.poll_transcription_status(
+                job_url, max_attempts=client.poll_attempts_for(longest)
+            )
+            content_urls = await client.get_transcription_files(files_url)
+            contents = await asyncio.gather(
+                *(client.fetch_transcription_content(url) for url in content_urls)
+            )
+            # 各結果の source（投入したcontentUrl）から、待っているジョブへ結果を振り分ける
+            for content in contents:
+                source = content.get("source")
+                if not source:
+                    continue
+                for future in waiters.pop(normalize_content_url(source), []):
+                    if future.done():
+                        continue
+                    try:
+                        future.set_result(content["combinedRecognizedPhrases"][0]["display"])
+                    except (KeyError, IndexError) as e:
+                        future.set_exception(
+                            HTTPException(status_code=500, detail=f"文字起こし結果が不正です: {str(e)}")
+                        )
+            for futures in waiters.values():
+                for future in futures:
+                    if not future.done():
+                        future.set_exception(
+                            HTTPException(status_code=500, detail="バッチ内に文字起こし結果が見つかりません")
+                        )
+        except Exception as e:
+            for futures in waiters.values():
+                for future in futures:
+                    if not future.done():
+                        future.set_exception(e)
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# アプリは api/app をカレントにして "function.xxx" としてimportする構成なので、同じようにパスを通す
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "app"))
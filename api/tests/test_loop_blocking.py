@@ -0,0 +1,192 @@
+"""
+パイプラインの各段がイベントループを止めていないことを確認する回帰テスト。
+
+SDK・ffmpeg・requests の呼び出しを「同期的にスリープする」スタブに差し替え、
+LoopLagMonitor を低い閾値で動かした状態で各段を実行する。
+同期呼び出しがスレッドに逃がされていなければ vr_event_loop_blocked_total が増える。
+"""
+import asyncio
+import os
+import struct
+import time
+import httpx
+import pytest
+from function import main, mp4_processor as mp4_module
+from function.blob_processor import AzBlobClient
+from function.loop_monitor import LoopLagMonitor
+from function.metrics import metrics
+from function.startup_profile import lazy_import
+from function.word_generator import create_word, cleanup_file
+
+# スタブの同期処理の時間と、ブロッキングとみなす閾値
+BLOCKING_SECONDS = 0.3
+THRESHOLD = 0.1
+
+
+def slow(result=None):
+    """
+    同期的にスリープしてから result を返す関数を作る。
+    """
+    def _call(*args, **kwargs):
+        time.sleep(BLOCKING_SECONDS)
+        return result
+    return _call
+
+
+def blocked_count() -> float:
+    return metrics.counter_value("event_loop_blocked_total")
+
+
+async def run_monitored(coro) -> float:
+    """
+    ループ監視を有効にした状態で coro を実行し、その間に検知されたブロッキングの回数を返す。
+    """
+    monitor = LoopLagMonitor(interval=0.02, threshold=THRESHOLD)
+    before = blocked_count()
+    await monitor.start()
+    try:
+        await coro
+        # 監視スレッドが最後の状態を確認できるよう少し待つ
+        await asyncio.sleep(THRESHOLD)
+    finally:
+        await monitor.stop()
+    return blocked_count() - before
+
+
+def wav_bytes(seconds: float, sample_rate: int = 16000) -> bytes:
+    data = b"\x00\x00" * int(seconds * sample_rate)
+    return struct.pack(
+        "<4sI4s4sIHHIIHH4sI",
+        b"RIFF", 36 + len(data), b"WAVE",
+        b"fmt ", 16, 1, 1, sample_rate, sample_rate * 2, 2, 16,
+        b"data", len(data),
+    ) + data
+
+
+class FakeDownloadStream:
+    readall = staticmethod(slow(b"blob-data"))
+
+
+class FakeBlobClient:
+    url = "https://example.blob.core.windows.net/container/blob"
+    upload_blob = staticmethod(slow())
+    download_blob = staticmethod(slow(FakeDownloadStream()))
+
+
+class FakeContainerClient:
+    delete_blob = staticmethod(slow())
+
+    def get_blob_client(self, blob):
+        return FakeBlobClient()
+
+
+class FakeBlobServiceClient:
+    def get_container_client(self, container):
+        return FakeContainerClient()
+
+    def get_blob_client(self, container, blob):
+        return FakeBlobClient()
+
+
+@pytest.fixture
+def fake_blob_sdk(monkeypatch):
+    monkeypatch.setattr(
+        lazy_import("azure.storage.blob").BlobServiceClient,
+        "from_connection_string",
+        lambda *args, **kwargs: FakeBlobServiceClient(),
+    )
+
+
+def test_control_blocking_sleep_is_detected():
+    """
+    テストの前提確認: コルーチン内の time.sleep は検知されること。
+    """
+    async def blocking():
+        time.sleep(BLOCKING_SECONDS)
+
+    assert asyncio.run(run_monitored(blocking())) >= 1
+
+
+def test_mp4_processor_does_not_block(monkeypatch):
+    def fake_ffmpeg(command, check):
+        time.sleep(BLOCKING_SECONDS)
+        with open(command[-1], "wb") as f:
+            f.write(wav_bytes(5))
+
+    monkeypatch.setattr(mp4_module, "get_ffmpeg_path", lambda: "ffmpeg")
+    monkeypatch.setattr(mp4_module.subprocess, "run", fake_ffmpeg)
+    silence_trim = {"threshold_db": -45, "min_silence_seconds": 2, "keep_silence_seconds": 0.5}
+
+    async def scenario():
+        result = await mp4_module.mp4_processor("meeting.mp4", b"\x00" * 1024, silence_trim)
+        assert result["file_wavname"] == "meeting.wav"
+
+    assert asyncio.run(run_monitored(scenario())) == 0
+
+
+def test_blob_client_does_not_block(fake_blob_sdk):
+    async def scenario():
+        client = AzBlobClient("connection", "container")
+        assert await client.upload_blob("a.wav", b"data") == FakeBlobClient.url
+        assert await client.read_blob("a.json") == b"blob-data"
+        assert await client.download_blob("a.mp4", "container", "connection") == b"blob-data"
+        await client.delete_blob("a.wav")
+
+    assert asyncio.run(run_monitored(scenario())) == 0
+
+
+def test_create_word_and_cleanup_do_not_block(monkeypatch):
+    document_class = lazy_import("docx.document").Document
+    original_save = document_class.save
+    original_remove = os.remove
+
+    def slow_save(self, path):
+        time.sleep(BLOCKING_SECONDS)
+        original_save(self, path)
+
+    def slow_remove(path):
+        time.sleep(BLOCKING_SECONDS)
+        original_remove(path)
+
+    monkeypatch.setattr(document_class, "save", slow_save)
+    monkeypatch.setattr(os, "remove", slow_remove)
+
+    async def scenario():
+        path = await create_word("議事録のテスト", file_name="議事録_test_loop_blocking.docx")
+        assert path.exists()
+        await cleanup_file(str(path))
+        assert not path.exists()
+
+    assert asyncio.run(run_monitored(scenario())) == 0
+
+
+class FakeResponse:
+    def __init__(self, payload):
+        self.payload = payload
+
+    def json(self):
+        return self.payload
+
+
+class FakeConfidentialClientApplication:
+    def __init__(self, *args, **kwargs):
+        pass
+
+    acquire_token_for_client = staticmethod(slow({"access_token": "token"}))
+
+
+def test_sharepoint_endpoints_do_not_block(monkeypatch):
+    monkeypatch.setattr(lazy_import("msal"), "ConfidentialClientApplication", FakeConfidentialClientApplication)
+    monkeypatch.setattr(lazy_import("requests"), "get", slow(FakeResponse({"value": []})))
+
+    async def scenario():
+        transport = httpx.ASGITransport(app=main.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            sites, directories = await asyncio.gather(
+                client.get("/sites"),
+                client.get("/directories/site-id"),
+            )
+        assert sites.status_code == 200 and sites.json() == {"value": []}
+        assert directories.status_code == 200 and directories.json() == {"value": []}
+
+    assert asyncio.run(run_monitored(scenario())) == 0
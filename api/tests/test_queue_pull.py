@@ -0,0 +1,112 @@
+"""
+キューからのジョブの受信と、メッセージのリースの扱いを確認するテスト。
+"""
+import asyncio
+import functools
+import json
+from types import SimpleNamespace
+from function import main
+from function.queue_lease import QueueMessageLease
+from function.scheduler import FairScheduler, ScheduledJob
+
+
+class FakeQueueClient:
+    def __init__(self, messages: list | None = None):
+        self.messages = messages or []
+        self.deleted = []
+
+    def receive_messages(self, max_messages=1, **kwargs):
+        received, self.messages = self.messages[:max_messages], self.messages[max_messages:]
+        return received
+
+    def update_message(self, message_id, pop_receipt=None, visibility_timeout=None):
+        return SimpleNamespace(pop_receipt=pop_receipt)
+
+    def delete_message(self, message_id, pop_receipt=None):
+        self.deleted.append(message_id)
+
+
+def make_app(scheduler: FairScheduler) -> SimpleNamespace:
+    state = SimpleNamespace(scheduler=scheduler, pull_lock=asyncio.Lock(), pull_tasks=set(), leases=set())
+    return SimpleNamespace(state=state)
+
+
+def submit_leased(app, queue_client, message_id: str) -> QueueMessageLease:
+    lease = QueueMessageLease(queue_client, SimpleNamespace(id=message_id, pop_receipt="r"))
+    lease.start()
+    app.state.leases.add(lease)
+    return lease
+
+
+def test_stop_keeps_messages_of_cancelled_jobs(monkeypatch):
+    queue_client = FakeQueueClient()
+    monkeypatch.setattr(main, "get_queue_client", lambda: queue_client)
+
+    async def scenario():
+        scheduler = FairScheduler(lane_concurrency={"short": 1, "long": 1})
+        scheduler.start()
+        app = make_app(scheduler)
+        started = asyncio.Event()
+
+        async def finishes():
+            pass
+
+        async def runs_until_cancelled():
+            started.set()
+            await asyncio.Event().wait()
+
+        for message_id, task, priority in (("m1", runs_until_cancelled, "high"), ("m2", finishes, "low")):
+            lease = submit_leased(app, queue_client, message_id)
+            await scheduler.submit(ScheduledJob(
+                job_id=message_id,
+                client_id="client",
+                project="project",
+                run=functools.partial(main.run_leased_job, app, {}, lease, task),
+                priority=priority,
+            ))
+        await started.wait()
+        await asyncio.sleep(0.05)
+        await scheduler.stop()
+        await asyncio.gather(*app.state.pull_tasks, return_exceptions=True)
+        return app
+
+    app = asyncio.run(scenario())
+    # 完了したジョブのメッセージだけが削除され、中断されたジョブのメッセージは残る
+    assert queue_client.deleted == ["m2"]
+    assert not app.state.leases
+
+
+def long_message(n: int) -> SimpleNamespace:
+    content = json.dumps({"project": "project", "project_Directory": "dir", "file_path": f"https://example/{n}.mp4", "job_id": f"m{n}", "duration_seconds": 3 * 3600})
+    return SimpleNamespace(id=f"m{n}", pop_receipt="r", content=content, dequeue_count=1, inserted_on=None)
+
+
+def test_pull_stops_while_a_lane_has_waiting_jobs(monkeypatch):
+    queue_client = FakeQueueClient([long_message(n) for n in range(20)])
+    monkeypatch.setattr(main, "get_queue_client", lambda: queue_client)
+
+    async def scenario():
+        scheduler = FairScheduler(lane_concurrency={"short": 3, "long": 1})
+        scheduler.start()
+        app = make_app(scheduler)
+        release = asyncio.Event()
+
+        async def long_job(*args):
+            await release.wait()
+
+        monkeypatch.setattr(main, "process_audio_task", long_job)
+        queued = []
+        # 長い録音しか無いキューから繰り返し受信しても、待ちは1回の受信分を超えて増えない
+        for _ in range(5):
+            await main.pull_jobs(app, {key: None for key in ("az_blob_client", "az_speech_client", "az_openai_client", "sp_access")})
+            await asyncio.sleep(0.01)
+            queued.append(scheduler.lanes["long"].queued)
+        release.set()
+        await scheduler.stop()
+        for lease in app.state.leases:
+            lease.abandon()
+        return queued
+
+    queued = asyncio.run(scenario())
+    assert queued == [3] * 5
+    assert len(queue_client.messages) == 16
@@ -0,0 +1,63 @@
+"""
+全文検索インデックスの回帰テスト。
+"""
+import threading
+from fastapi.testclient import TestClient
+from function import main
+from function.search_index import SearchIndex
+
+
+def test_search_during_merges_does_not_fail(tmp_path):
+    """
+    マージで外れたセグメントを、別スレッドの検索が読んでいる途中に閉じてしまわないこと。
+    """
+    index = SearchIndex(str(tmp_path), merge_factor=2)
+    for i in range(4):
+        index.add_document(f"seed{i}", {"project": "P"}, f"予算会議{i}の文字起こし", f"予算の要約{i}")
+    errors = []
+    done = threading.Event()
+
+    def searcher():
+        while not done.is_set():
+            try:
+                index.search("予算", limit=50)
+            except Exception as e:
+                errors.append(e)
+                return
+
+    threads = [threading.Thread(target=searcher) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    try:
+        for i in range(40):
+            index.add_document(f"job{i}", {"project": "P"}, f"予算会議{i}の文字起こし", f"予算の要約{i}")
+    finally:
+        done.set()
+        for thread in threads:
+            thread.join()
+    assert errors == []
+    assert len(index.search("予算", limit=100)) == 44
+
+
+def test_readding_document_replaces_old_version(tmp_path):
+    index = SearchIndex(str(tmp_path), merge_factor=2)
+    index.add_document("job", {"title": "old"}, "古い会議資料", "古い要約")
+    for i in range(3):
+        index.add_document(f"other{i}", {}, "別の会議", "別の要約")
+    index.add_document("job", {"title": "new"}, "新しい会議資料", "新しい要約")
+    assert [hit["title"] for hit in index.search("会議資料")] == ["new"]
+    assert index.search("古い") == []
+
+
+def test_search_without_index_dir_is_unavailable(monkeypatch):
+    """
+    SEARCH_INDEX_DIR が未設定なら一時ディレクトリに索引を作らず、/search は503を返すこと。
+    """
+    monkeypatch.setattr(main, "SEARCH_INDEX_DIR", None)
+    main.get_search_index.cache_clear()
+    try:
+        assert main.get_search_index() is None
+        response = TestClient(main.app).get("/search", params={"q": "予算"})
+        assert response.status_code == 503
+    finally:
+        main.get_search_index.cache_clear()
@@ -0,0 +1,60 @@
+"""
+TranscriptionBatcher が長さの区分ごとにジョブをまとめることを確認するテスト。
+"""
+import asyncio
+from types import SimpleNamespace
+from function.transcription_batcher import TranscriptionBatcher
+
+
+class FakeSpeechClient:
+    def __init__(self):
+        self.session = SimpleNamespace(closed=False)
+        self.jobs: list[list[str]] = []
+        self.long_job_done = asyncio.Event()
+
+    def poll_attempts_for(self, duration_seconds):
+        return 1
+
+    async def create_transcription_job(self, blob_urls):
+        self.jobs.append(blob_urls)
+        return len(self.jobs) - 1
+
+    async def poll_transcription_status(self, job_url, max_attempts):
+        # 長い録音を含むジョブは、テストが終わらせるまで完了しない
+        if any("long" in url for url in self.jobs[job_url]):
+            await self.long_job_done.wait()
+        return job_url
+
+    async def get_transcription_files(self, files_url):
+        return self.jobs[files_url]
+
+    async def fetch_transcription_content(self, url):
+        return {"source": url, "combinedRecognizedPhrases": [{"display": f"text of {url}"}]}
+
+
+def test_short_recordings_are_not_batched_with_long_or_unknown_ones():
+    async def scenario():
+        client = FakeSpeechClient()
+        batcher = TranscriptionBatcher(client, window_seconds=0.01, short_job_max_seconds=1800)
+        long_task = asyncio.create_task(batcher.transcribe("https://example/long.wav", 3 * 3600))
+        unknown_task = asyncio.create_task(batcher.transcribe("https://example/unknown.wav", None))
+        short_results = await asyncio.wait_for(
+            asyncio.gather(
+                batcher.transcribe("https://example/standup.wav", 600),
+                batcher.transcribe("https://example/sync.wav", 900),
+            ),
+            timeout=1,
+        )
+        assert not long_task.done()
+        client.long_job_done.set()
+        return client.jobs, short_results, await long_task, await unknown_task
+
+    jobs, short_results, long_result, unknown_result = asyncio.run(scenario())
+    assert short_results == ["text of https://example/standup.wav", "text of https://example/sync.wav"]
+    assert long_result == "text of https://example/long.wav"
+    assert unknown_result == "text of https://example/unknown.wav"
+    assert sorted(jobs) == sorted([
+        ["https://example/long.wav"],
+        ["https://example/unknown.wav"],
+        ["https://example/standup.wav", "https://example/sync.wav"],
+    ])
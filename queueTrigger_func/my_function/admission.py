@@ -0,0 +1,162 @@
+import json
+import shutil
+import tempfile
+import threading
+import time
+from dataclasses import dataclass, asdict
+
+
+@dataclass
+class AdmissionDecision:
+    admitted: bool
+    status_code: int = 200
+    reason: str = ""
+    retry_after: int = 0
+    estimated_start_at: float | None = None
+    queue_depth: int = 0
+    backlog_minutes: float = 0.0
+
+    def to_dict(self) -> dict:
+        return asdict(self)
+
+
+def get_available_memory() -> int | None:
+    """
+    利用可能なメモリ量（バイト）を返す。取得できない環境ではNoneを返す。
+    """
+    try:
+        with open("/proc/meminfo") as f:
+            for line in f:
+                if line.startswith("MemAvailable:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return None
+
+
+class AdmissionController:
+    def __init__(
+        self,
+        connection_string: str | None,
+        queue_name: str | None,
+        max_queue_depth: int = 200,
+        max_backlog_minutes: float = 600,
+        min_free_disk_bytes: int = 1024 ** 3,
+        min_free_memory_bytes: int = 512 * 1024 ** 2,
+        minutes_per_minute: float = 4.0,
+        bytes_per_second: float = 250000,
+        cache_seconds: float = 5.0,
+    ):
+        """
+        キューの混雑度とローカル資源から、アップロードを受け付けるか判定するクラスの初期化。
+
+        :param max_queue_depth: 受け付けを止めるキューのメッセージ数
+        :param max_backlog_minutes: 受け付けを止める未処理音声の合計分数
+        :param min_free_disk_bytes: アップロード後に残すべき空きディスク容量
+        :param min_free_memory_bytes: アップロード後に残すべき空きメモリ量
+        :param minutes_per_minute: ワーカー全体が1分あたりに処理できる音声の分数
+        :param bytes_per_second: 長さが不明なメッセージの長さをファイルサイズから推定する際のビットレート
+        :param cache_seconds: キューの状態をキャッシュする秒数
+        """
+        self.connection_string = connection_string
+        self.queue_name = queue_name
+        self.max_queue_depth = max_queue_depth
+        self.max_backlog_minutes = max_backlog_minutes
+        self.min_free_disk_bytes = min_free_disk_bytes
+        self.min_free_memory_bytes = min_free_memory_bytes
+        self.minutes_per_minute = minutes_per_minute
+        self.bytes_per_second = bytes_per_second
+        self.cache_seconds = cache_seconds
+        self._queue_client = None
+        self._lock = threading.Lock()
+        self._snapshot: tuple[float, int, float] | None = None
+
+    def _get_queue_client(self):
+        if self._queue_client is None:
+            from azure.storage.queue import QueueClient
+            self._queue_client = QueueClient.from_connection_string(self.connection_string, self.queue_name)
+        return self._queue_client
+
+    def _estimate_message_minutes(self, content: str) -> float | None:
+        try:
+            data = json.loads(content)
+        except (TypeError, ValueError):
+            return None
+        if data.get("duration_seconds"):
+            return data["duration_seconds"] / 60
+        if data.get("file_size"):
+            return data["file_size"] / self.bytes_per_second / 60
+        return None
+
+    def queue_snapshot(self) -> tuple[int, float]:
+        """
+        キューのメッセージ数と、未処理音声の推定合計分数を返す。
+        メッセージ数はキューのプロパティから、分数は先頭メッセージの平均から外挿する。
+        ワーカーは空きスロット分しか受信せず、処理が終わるまでメッセージを削除しないので、
+        メッセージ数には待ちのジョブと処理中のジョブ（不可視のメッセージ）の両方が含まれる。
+        """
+        if not self.connection_string or not self.queue_name:
+            return 0, 0.0
+        with self._lock:
+            now = time.monotonic()
+            if self._snapshot is not None and now - self._snapshot[0] < self.cache_seconds:
+                return self._snapshot[1], self._snapshot[2]
+            queue_client = self._get_queue_client()
+            depth = queue_client.get_queue_properties().approximate_message_count or 0
+            backlog_minutes = 0.0
+            if depth:
+                estimates = [
+                    minutes
+                    for msg in queue_client.peek_messages(max_messages=32)
+                    if (minutes := self._estimate_message_minutes(msg.content)) is not None
+                ]
+                if estimates:
+                    backlog_minutes = sum(estimates) / len(estimates) * depth
+            self._snapshot = (now, depth, backlog_minutes)
+            return depth, backlog_minutes
+
+    def _wait_seconds(self, backlog_minutes: float) -> float:
+        return backlog_minutes / max(self.minutes_per_minute, 0.01) * 60
+
+    def evaluate(self, incoming_bytes: int | None = None) -> AdmissionDecision:
+        """
+        新しいアップロードを受け付けるか判定する。
+        受け付けない場合は再試行までの秒数と、受け付けた場合の処理開始見込み時刻を返す。
+        """
+        incoming_bytes = incoming_bytes or 0
+        depth, backlog_minutes = self.queue_snapshot()
+        wait_seconds = self._wait_seconds(backlog_minutes)
+        decision = AdmissionDecision(
+            admitted=True,
+            estimated_start_at=time.time() + wait_seconds,
+            queue_depth=depth,
+            backlog_minutes=round(backlog_minutes, 1),
+        )
+
+        # ローカル資源が足りない場合は一時的に利用不可（503）
+        free_disk = shutil.disk_usage(tempfile.gettempdir()).free
+        if free_disk - incoming_bytes < self.min_free_disk_bytes:
+            decision.admitted = False
+            decision.status_code = 503
+            decision.reason = "insufficient_disk"
+            decision.retry_after = 60
+            return decision
+        free_memory = get_available_memory()
+        if free_memory is not None and free_memory - incoming_bytes < self.min_free_memory_bytes:
+            decision.admitted = False
+            decision.status_code = 503
+            decision.reason = "insufficient_memory"
+            decision.retry_after = 30
+            return decision
+
+        # キューが詰まっている場合は混雑（429）。上限を下回るまでの時間を再試行の目安にする
+        if depth >= self.max_queue_depth or backlog_minutes >= self.max_backlog_minutes:
+            excess_minutes = backlog_minutes - self.max_backlog_minutes
+            if depth >= self.max_queue_depth and depth:
+                excess_minutes = max(excess_minutes, backlog_minutes * (depth - self.max_queue_depth + 1) / depth)
+            decision.admitted = False
+            decision.status_code = 429
+            decision.reason = "queue_backlogged"
+            decision.retry_after = int(min(max(self._wait_seconds(max(excess_minutes, 0.0)), 30), 3600))
+            return decision
+        return decision
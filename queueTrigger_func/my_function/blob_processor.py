@@ -1,7 +1,17 @@
-from azure.storage.blob import BlobServiceClient
+import asyncio
+import functools
 from fastapi import HTTPException
 
 
+@functools.cache
+def get_blob_service_client(blob_connection: str):
+    """
+    接続文字列ごとにBlobServiceClientを作成し、プロセス内で使い回す。
+    """
+    from azure.storage.blob import BlobServiceClient
+    return BlobServiceClient.from_connection_string(blob_connection)
+
+
 async def upload_blob(file_name: str, file_data: bytes, container_name: str, blob_connection: str) -> str:
     """
     Azure Blob Storageにファイルをアップロードする関数。
@@ -14,11 +24,11 @@ async def upload_blob(file_name: str, file_data: bytes, container_name: str, blo
     """
     try:
         # BlobServiceClientの初期化
-        blob_service_client = BlobServiceClient.from_connection_string(blob_connection)
+        blob_service_client = get_blob_service_client(blob_connection)
         blob_client = blob_service_client.get_blob_client(container=container_name, blob=file_name)
 
-        # ファイルをアップロード
-        blob_client.upload_blob(file_data, overwrite=True)
+        # ファイルをアップロード（同期APIなのでスレッドで実行）
+        await asyncio.to_thread(blob_client.upload_blob, file_data, overwrite=True)
 
         # アップロードしたBlobのURLを返す
         return blob_client.url
@@ -37,11 +47,11 @@ async def delete_blob(blob_name: str, container_name: str, connection_string: st
     """
     try:
         # BlobServiceClientの初期化
-        blob_service_client = BlobServiceClient.from_connection_string(connection_string)
+        blob_service_client = get_blob_service_client(connection_string)
         container_client = blob_service_client.get_container_client(container_name)
 
         # Blobを削除
-        container_client.delete_blob(blob_name)
+        await asyncio.to_thread(container_client.delete_blob, blob_name)
     except Exception as e:
         # エラー発生時はFastAPI用のHTTPExceptionをスロー
         raise HTTPException(status_code=500, detail=f"Failed to delete blob: {str(e)}")
@@ -1,11 +1,17 @@
-from fastapi import FastAPI, File, UploadFile, HTTPException,Form
+from fastapi import FastAPI, File, UploadFile, HTTPException,Form,Request
 from fastapi import Body
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import PlainTextResponse, JSONResponse
+import asyncio
 import logging
 import os
+import uuid
 from dotenv import load_dotenv
 from my_function.blob_processor import upload_blob, delete_blob
 from my_function.send_message import send_message_to_queue
+from my_function.metrics import metrics
+from my_function.admission import AdmissionController
+from my_function.media_probe import probe_media, MediaProbeError
 from pydantic import BaseModel
 
 # 環境変数をロード
@@ -16,6 +22,16 @@ AZ_SPEECH_KEY = os.getenv("AZ_SPEECH_KEY").strip()
 AZ_SPEECH_ENDPOINT = os.getenv("AZ_SPEECH_ENDPOINT").strip()
 AZ_BLOB_CONNECTION = os.getenv("AZ_BLOB_CONNECTION").strip()
 CONTAINER_NAME = os.getenv("CONTAINER_NAME").strip()
+CONNECTION_STRING = os.getenv("CONNECTION_STRING")
+QUEUE_NAME = os.getenv("QUEUE_NAME")
+# 流入制御の設定
+ADMISSION_MAX_QUEUE_DEPTH = int(os.getenv("ADMISSION_MAX_QUEUE_DEPTH", "200"))
+ADMISSION_MAX_BACKLOG_MINUTES = float(os.getenv("ADMISSION_MAX_BACKLOG_MINUTES", "600"))
+ADMISSION_MIN_FREE_DISK_MB = int(os.getenv("ADMISSION_MIN_FREE_DISK_MB", "1024"))
+ADMISSION_MIN_FREE_MEMORY_MB = int(os.getenv("ADMISSION_MIN_FREE_MEMORY_MB", "512"))
+WORKER_AUDIO_MINUTES_PER_MINUTE = float(os.getenv("WORKER_AUDIO_MINUTES_PER_MINUTE", "4"))
+# これより短い音声は処理せずに拒否する（秒）
+MIN_AUDIO_SECONDS = float(os.getenv("MIN_AUDIO_SECONDS", "1"))
 
 # ログ設定
 logging.basicConfig(level=logging.INFO)
@@ -24,6 +40,48 @@ logger = logging.getLogger("FastAPIApp")
 # FastAPIアプリケーションの初期化
 app = FastAPI()
 
+admission = AdmissionController(
+    CONNECTION_STRING,
+    QUEUE_NAME,
+    max_queue_depth=ADMISSION_MAX_QUEUE_DEPTH,
+    max_backlog_minutes=ADMISSION_MAX_BACKLOG_MINUTES,
+    min_free_disk_bytes=ADMISSION_MIN_FREE_DISK_MB * 1024 * 1024,
+    min_free_memory_bytes=ADMISSION_MIN_FREE_MEMORY_MB * 1024 * 1024,
+    minutes_per_minute=WORKER_AUDIO_MINUTES_PER_MINUTE,
+)
+
+def admission_response(decision) -> JSONResponse:
+    """
+    受け付けられない場合のレスポンスを作成する（Retry-Afterヘッダ付き）
+    """
+    return JSONResponse(
+        status_code=decision.status_code,
+        content=decision.to_dict(),
+        headers={"Retry-After": str(decision.retry_after)},
+    )
+
+# CORSより内側で動くよう、CORSミドルウェアより先に登録する
+@app.middleware("http")
+async def admission_control(request: Request, call_next):
+    """
+    アップロード本体を受信する前に、キューの混雑とローカル資源を確認して早期に429/503を返す
+    """
+    if request.method == "POST" and request.url.path == "/transcribe":
+        content_length = request.headers.get("content-length")
+        incoming_bytes = int(content_length) if content_length and content_length.isdigit() else None
+        try:
+            decision = await asyncio.to_thread(admission.evaluate, incoming_bytes)
+        except Exception as e:
+            # 判定に失敗した場合は受け付けを止めない
+            logger.warning(f"Admission check failed: {str(e)}")
+        else:
+            if not decision.admitted:
+                metrics.inc("ingress_requests_total", status=f"throttled_{decision.status_code}")
+                logger.info(f"Upload rejected by admission control: {decision.reason}")
+                return admission_response(decision)
+            request.state.admission = decision
+    return await call_next(request)
+
 # CORS設定
 app.add_middleware(
     CORSMiddleware,
@@ -31,6 +89,7 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["Retry-After"],
 )
 
 class FileData(BaseModel):
@@ -38,19 +97,41 @@ class FileData(BaseModel):
     file_name: str
 
 @app.post("/transcribe")
-async def main(file: UploadFile = File(...),client_id: str = Form(...),project: str = Form(...),project_directory: str = Form(...)):
+async def main(request: Request,file: UploadFile = File(...),client_id: str = Form(...),project: str = Form(...),project_directory: str = Form(...),priority: str = Form("normal")):
     """
     BlobへMP4ファイルをアップロードし、Queueへメッセージを送信するエンドポイント
+    priority には "high"、"normal"、"low" を指定でき、ワーカー側のスケジューラが参照する
     """
+    if priority not in ("high", "normal", "low"):
+        raise HTTPException(status_code=400, detail={"error": f"Invalid priority: {priority}"})
+    # ジョブIDを発行し、キューメッセージ経由でワーカーまで引き継ぐ
+    job_id = uuid.uuid4().hex
     try:
-        logger.info("Processing request...")
+        logger.info(f"Processing request... job_id={job_id}")
 
         file_name = file.filename
-        file_data = await file.read()
+        with metrics.timer("ingress_stage_duration_seconds", stage="read_body"):
+            file_data = await file.read()
+        metrics.inc("ingress_upload_bytes_total", len(file_data))
+
+        # ヘッダのみを解析して長さ・コーデックを取得し、壊れたファイルや音声の無いファイルを早期に拒否する
+        with metrics.timer("ingress_stage_duration_seconds", stage="probe"):
+            try:
+                media_info = probe_media(file_name, file_data)
+            except MediaProbeError as e:
+                metrics.inc("ingress_requests_total", status="invalid_media")
+                raise HTTPException(status_code=422, detail={"error": f"Invalid media file: {str(e)}"})
+        # 長さが不明（None）な場合は拒否せず、ワーカー側でファイルサイズから推定する
+        too_short = media_info.duration_seconds is not None and media_info.duration_seconds < MIN_AUDIO_SECONDS
+        if media_info.audio_tracks == 0 or too_short:
+            metrics.inc("ingress_requests_total", status="invalid_media")
+            raise HTTPException(status_code=422, detail={"error": "The file has no audio to transcribe", "media": media_info.to_dict()})
+        logger.info(f"Media probed: {media_info.to_dict()} job_id={job_id}")
 
         # Azure Blob Storage にアップロード
-        blob_url = await upload_blob(file_name, file_data, CONTAINER_NAME, AZ_BLOB_CONNECTION)
-        logger.info(f"Blob uploaded: {blob_url}")
+        with metrics.timer("ingress_stage_duration_seconds", stage="upload_blob"):
+            blob_url = await upload_blob(file_name, file_data, CONTAINER_NAME, AZ_BLOB_CONNECTION)
+        logger.info(f"Blob uploaded: {blob_url} job_id={job_id}")
 
         sanitized_filename = os.path.basename(file.filename)
         file_extension = os.path.splitext(sanitized_filename)[1].lower()
@@ -58,14 +139,42 @@ async def main(file: UploadFile = File(...),client_id: str = Form(...),project:
         print(blob_url)
 
         if file_extension == ".mp4":
-            send_message_to_queue(project,project_directory,blob_url,client_id)
+            with metrics.timer("ingress_stage_duration_seconds", stage="enqueue"):
+                await asyncio.to_thread(send_message_to_queue, project, project_directory, blob_url, client_id, job_id, len(file_data), priority, media_info.to_dict())
+            metrics.inc("ingress_requests_total", status="enqueued")
             print("finished_sending")
-            logger.info(f"Waiting for HTTP request to process MP4 file") 
+            logger.info(f"Waiting for HTTP request to process MP4 file job_id={job_id}")
+            decision = getattr(request.state, "admission", None)
+            return {
+                "job_id": job_id,
+                "estimated_start_at": decision.estimated_start_at if decision else None,
+                "media": media_info.to_dict(),
+            }
         else:
+            metrics.inc("ingress_requests_total", status="rejected")
             print("A video has been uploaded in the wrong file format.")
+    except HTTPException:
+        raise
     except Exception as e:
-        logger.error(f"Error occurred: {str(e)}")
+        metrics.inc("ingress_requests_total", status="error")
+        logger.error(f"Error occurred: {str(e)} job_id={job_id}")
         raise HTTPException(status_code=500, detail={"error": str(e)})
-    
 
- 
\ No newline at end of file
+
+@app.get("/admission")
+async def get_admission(size: int | None = None):
+    """
+    アップロード前に受け付け可否と処理開始見込み時刻を確認するエンドポイント
+    """
+    decision = await asyncio.to_thread(admission.evaluate, size)
+    if not decision.admitted:
+        return admission_response(decision)
+    return decision.to_dict()
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def get_metrics():
+    """
+    Prometheus形式でメトリクスを返すエンドポイント
+    """
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
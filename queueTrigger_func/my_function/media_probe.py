@@ -0,0 +1,193 @@
+import struct
+from dataclasses import dataclass, field, asdict
+
+
+class MediaProbeError(Exception):
+    """
+    メディアのヘッダを解析できない（破損している、未対応の形式など）場合の例外。
+    """
+
+
+@dataclass
+class MediaInfo:
+    container: str
+    # 長さが分からない場合（mehd の無い fragmented MP4 など）は None
+    duration_seconds: float | None = 0.0
+    audio_tracks: int = 0
+    video_tracks: int = 0
+    codecs: list[str] = field(default_factory=list)
+    sample_rate: int | None = None
+    channels: int | None = None
+
+    def to_dict(self) -> dict:
+        return asdict(self)
+
+
+def _iter_boxes(data: memoryview, start: int, end: int):
+    """
+    ISO BMFF（MP4）のボックスを (type, 本体の開始位置, 終了位置) で列挙する。
+    """
+    offset = start
+    while offset + 8 <= end:
+        size, box_type = struct.unpack_from(">I4s", data, offset)
+        header = 8
+        if size == 1:
+            if offset + 16 > end:
+                raise MediaProbeError("truncated box header")
+            size = struct.unpack_from(">Q", data, offset + 8)[0]
+            header = 16
+        elif size == 0:
+            size = end - offset
+        if size < header or offset + size > end:
+            raise MediaProbeError(f"invalid size for box {box_type!r}")
+        yield box_type, offset + header, offset + size
+        offset += size
+
+
+def _find_box(data: memoryview, start: int, end: int, box_type: bytes):
+    for found_type, body_start, body_end in _iter_boxes(data, start, end):
+        if found_type == box_type:
+            return body_start, body_end
+    return None
+
+
+def _unpack_box(fmt: str, data: memoryview, offset: int, body_end: int) -> tuple:
+    """
+    ボックスの本体から値を読む。ボックスの終わりを越える場合は MediaProbeError を送出する。
+    """
+    if offset + struct.calcsize(fmt) > body_end:
+        raise MediaProbeError("truncated box")
+    return struct.unpack_from(fmt, data, offset)
+
+
+def _read_timescale_duration(data: memoryview, body_start: int, body_end: int) -> tuple[int, int]:
+    """
+    mvhd / mdhd ボックスから timescale と duration を読む。
+    """
+    version = _unpack_box(">B", data, body_start, body_end)[0]
+    if version == 1:
+        timescale, duration = _unpack_box(">IQ", data, body_start + 4 + 16, body_end)
+    else:
+        timescale, duration = _unpack_box(">II", data, body_start + 4 + 8, body_end)
+    return timescale, duration
+
+
+def _probe_track(data: memoryview, info: MediaInfo, trak: tuple[int, int]):
+    mdia = _find_box(data, *trak, b"mdia")
+    if mdia is None:
+        return
+    hdlr = _find_box(data, *mdia, b"hdlr")
+    handler = _unpack_box(">4s", data, hdlr[0] + 8, hdlr[1])[0] if hdlr else b""
+    if handler == b"vide":
+        info.video_tracks += 1
+    elif handler == b"soun":
+        info.audio_tracks += 1
+    else:
+        return
+
+    mdhd = _find_box(data, *mdia, b"mdhd")
+    if mdhd is not None and handler == b"soun" and info.audio_tracks == 1:
+        timescale, duration = _read_timescale_duration(data, *mdhd)
+        # fragmented MP4 では mdhd の duration が0なので、その場合は上書きしない
+        if timescale and duration:
+            info.duration_seconds = duration / timescale
+
+    minf = _find_box(data, *mdia, b"minf")
+    stbl = _find_box(data, *minf, b"stbl") if minf else None
+    stsd = _find_box(data, *stbl, b"stsd") if stbl else None
+    if stsd is None:
+        return
+    # stsd: version/flags(4), entry_count(4), 以降にサンプルエントリ
+    if stsd[0] + 8 > stsd[1]:
+        raise MediaProbeError("truncated box")
+    for codec, entry_start, entry_end in _iter_boxes(data, stsd[0] + 8, stsd[1]):
+        info.codecs.append(codec.decode("latin-1").strip())
+        if handler == b"soun" and entry_end - entry_start >= 28:
+            # AudioSampleEntry: reserved(6) data_reference_index(2) version(2) revision(2) vendor(4)
+            # channelcount(2) samplesize(2) compression_id(2) packet_size(2) samplerate(16.16)
+            channels = _unpack_box(">H", data, entry_start + 16, entry_end)[0]
+            sample_rate = _unpack_box(">I", data, entry_start + 24, entry_end)[0] >> 16
+            if info.sample_rate is None:
+                info.sample_rate = sample_rate
+                info.channels = channels
+
+
+def probe_mp4(data: bytes) -> MediaInfo:
+    """
+    MP4（ISO BMFF）のmoovボックスだけを解析し、デコードせずにメディア情報を取得する。
+    """
+    view = memoryview(data)
+    info = MediaInfo(container="mp4")
+    moov = _find_box(view, 0, len(view), b"moov")
+    if moov is None:
+        raise MediaProbeError("moov box not found")
+    mvhd = _find_box(view, *moov, b"mvhd")
+    movie_timescale = 0
+    if mvhd is not None:
+        movie_timescale, duration = _read_timescale_duration(view, *mvhd)
+        if movie_timescale:
+            info.duration_seconds = duration / movie_timescale
+    for box_type, body_start, body_end in _iter_boxes(view, *moov):
+        if box_type == b"trak":
+            _probe_track(view, info, (body_start, body_end))
+    if not info.duration_seconds:
+        # fragmented MP4 では mvhd / mdhd の duration が0で、全体の長さは mvex/mehd にある
+        mvex = _find_box(view, *moov, b"mvex")
+        mehd = _find_box(view, *mvex, b"mehd") if mvex else None
+        if mehd is not None and movie_timescale:
+            if _unpack_box(">B", view, *mehd)[0] == 1:
+                fragment_duration = _unpack_box(">Q", view, mehd[0] + 4, mehd[1])[0]
+            else:
+                fragment_duration = _unpack_box(">I", view, mehd[0] + 4, mehd[1])[0]
+            info.duration_seconds = fragment_duration / movie_timescale
+    if not info.duration_seconds and info.audio_tracks:
+        # 音声トラックはあるが長さが分からない場合は、拒否せず不明として扱う
+        info.duration_seconds = None
+    return info
+
+
+def probe_wav(data: bytes) -> MediaInfo:
+    """
+    WAV（RIFF）のfmt/dataチャンクを解析してメディア情報を取得する。
+    """
+    if len(data) < 12 or data[:4] != b"RIFF" or data[8:12] != b"WAVE":
+        raise MediaProbeError("not a RIFF/WAVE file")
+    info = MediaInfo(container="wav")
+    byte_rate = 0
+    offset = 12
+    while offset + 8 <= len(data):
+        chunk_id, chunk_size = struct.unpack_from("<4sI", data, offset)
+        body = offset + 8
+        if chunk_id == b"fmt ":
+            if chunk_size < 16 or body + 16 > len(data):
+                raise MediaProbeError("invalid fmt chunk")
+            audio_format, channels, sample_rate, byte_rate = struct.unpack_from("<HHII", data, body)
+            info.codecs.append("pcm" if audio_format == 1 else f"wav_format_{audio_format}")
+            info.channels = channels
+            info.sample_rate = sample_rate
+            info.audio_tracks = 1
+        elif chunk_id == b"data":
+            if not byte_rate:
+                raise MediaProbeError("data chunk appears before fmt chunk")
+            # 書き込み途中のファイルではサイズが実データより大きいことがあるので実サイズで切る
+            data_size = min(chunk_size, len(data) - body)
+            info.duration_seconds = data_size / byte_rate
+            return info
+        offset = body + chunk_size + (chunk_size & 1)
+    raise MediaProbeError("data chunk not found")
+
+
+def probe_media(file_name: str, data: bytes) -> MediaInfo:
+    """
+    拡張子とマジックナンバーからコンテナを判定し、メディア情報を取得する。
+    解析できない場合は MediaProbeError を送出する。
+    """
+    try:
+        if data[:4] == b"RIFF":
+            return probe_wav(data)
+        if data[4:8] in (b"ftyp", b"moov", b"mdat", b"free", b"skip", b"wide") or file_name.lower().endswith(".mp4"):
+            return probe_mp4(data)
+    except (struct.error, IndexError) as e:
+        # 境界チェックの漏れで壊れたヘッダが別の例外になっても、解析できないファイルとして扱う
+        raise MediaProbeError(f"corrupted header: {str(e)}") from e
+    raise MediaProbeError("unsupported container")
@@ -1,18 +1,29 @@
-def send_message_to_queue(project: str,project_Directory: str,file_path: str,client_id: str):
-    from azure.storage.queue import QueueClient
-    import json
-    import os
-    from dotenv import load_dotenv
+import functools
+import json
+import os
+import time
+from dotenv import load_dotenv
+
+# .env を読み込む（モジュール読み込み時に1回だけ）
+load_dotenv()
 
-    # .env を読み込む
-    load_dotenv()
+
+@functools.cache
+def get_queue_client():
+    """
+    QueueClientを作成する（プロセス内で使い回す）。
+    """
+    from azure.storage.queue import QueueClient
 
     # 環境変数から connection_string を取得
     connection_string = os.getenv("CONNECTION_STRING")
     queue_name = os.getenv("QUEUE_NAME")
-    
-    # QueueClientのインスタンスを作成
-    queue_client = QueueClient.from_connection_string(connection_string, queue_name)
+    return QueueClient.from_connection_string(connection_string, queue_name)
+
+
+def send_message_to_queue(project: str,project_Directory: str,file_path: str,client_id: str,job_id: str,file_size: int,priority: str = "normal",media: dict | None = None):
+    # QueueClientのインスタンスを取得
+    queue_client = get_queue_client()
     message = "start_vm_task"
 
     # メッセージとして送信するデータを作成
@@ -21,9 +32,15 @@ def send_message_to_queue(project: str,project_Directory: str,file_path: str,cli
         "project_Directory":project_Directory,
         "file_path": file_path,
         "client_id":client_id,
+        "job_id":job_id,
+        "file_size":file_size,
+        "priority":priority,
+        "duration_seconds":media["duration_seconds"] if media else None,
+        "media":media,
+        "enqueued_at":time.time(),
         "message": message
     }
     
     # JSON形式にシリアライズしてメッセージを送信
     queue_client.send_message(json.dumps(message_data))
-    print(f"Sent message with file path and task id: {file_path}, {message}")
\ No newline at end of file
+    print(f"Sent message with file path and task id: {file_path}, {message}, job_id={job_id}")
\ No newline at end of file
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# 関数アプリは queueTrigger_func をルートにして "my_function.xxx" としてimportする構成なので、同じようにパスを通す
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
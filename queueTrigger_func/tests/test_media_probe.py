@@ -0,0 +1,66 @@
+"""
+MP4のヘッダ解析（probe_mp4）の回帰テスト。テスト用のボックスはその場で組み立てる。
+"""
+import struct
+import pytest
+from my_function.media_probe import probe_media, MediaProbeError
+
+
+def box(box_type: bytes, body: bytes) -> bytes:
+    return struct.pack(">I4s", 8 + len(body), box_type) + body
+
+
+def full_box(box_type: bytes, version: int, body: bytes) -> bytes:
+    return box(box_type, bytes([version, 0, 0, 0]) + body)
+
+
+def audio_mp4(
+    movie_duration: int,
+    track_duration: int,
+    mvex: bytes = b"",
+    movie_timescale: int = 1000,
+    mvhd: bytes | None = None,
+    mdhd: bytes | None = None,
+) -> bytes:
+    if mvhd is None:
+        mvhd = full_box(b"mvhd", 0, b"\0" * 8 + struct.pack(">II", movie_timescale, movie_duration) + b"\0" * 80)
+    if mdhd is None:
+        mdhd = full_box(b"mdhd", 0, b"\0" * 8 + struct.pack(">II", 48000, track_duration) + b"\0" * 4)
+    hdlr = full_box(b"hdlr", 0, b"\0" * 4 + b"soun" + b"\0" * 13)
+    entry = box(b"mp4a", b"\0" * 6 + struct.pack(">H", 1) + b"\0" * 8 + struct.pack(">HHHHI", 2, 16, 0, 0, 48000 << 16))
+    stsd = full_box(b"stsd", 0, struct.pack(">I", 1) + entry)
+    trak = box(b"trak", box(b"mdia", mdhd + hdlr + box(b"minf", box(b"stbl", stsd))))
+    return box(b"ftyp", b"isom" + b"\0" * 4) + box(b"moov", mvhd + trak + mvex)
+
+
+def test_regular_mp4_duration():
+    info = probe_media("meeting.mp4", audio_mp4(movie_duration=90_000, track_duration=90 * 48000))
+    assert info.audio_tracks == 1
+    assert info.duration_seconds == pytest.approx(90.0)
+
+
+@pytest.mark.parametrize("version, packed", [(0, struct.pack(">I", 600_000)), (1, struct.pack(">Q", 600_000))])
+def test_fragmented_mp4_reads_mehd(version, packed):
+    mvex = box(b"mvex", full_box(b"mehd", version, packed))
+    info = probe_media("meeting.mp4", audio_mp4(movie_duration=0, track_duration=0, mvex=mvex))
+    assert info.duration_seconds == pytest.approx(600.0)
+
+
+def test_fragmented_mp4_without_mehd_has_unknown_duration():
+    info = probe_media("meeting.mp4", audio_mp4(movie_duration=0, track_duration=0))
+    assert info.audio_tracks == 1
+    assert info.duration_seconds is None
+
+
+@pytest.mark.parametrize("boxes", [
+    {"mvhd": box(b"mvhd", b"")},
+    {"mvhd": box(b"mvhd", b"\0" * 4)},
+    # 本体の途中で切れていて、そのまま読むと次のボックスの中身を読んでしまう
+    {"mvhd": full_box(b"mvhd", 0, b"\0" * 8)},
+    {"mdhd": full_box(b"mdhd", 1, b"\0" * 16)},
+    {"mvex": box(b"mvex", full_box(b"mehd", 1, struct.pack(">I", 600_000)))},
+])
+def test_truncated_boxes_raise_media_probe_error(boxes):
+    data = audio_mp4(movie_duration=0, track_duration=0, **boxes)
+    with pytest.raises(MediaProbeError):
+        probe_media("meeting.mp4", data)